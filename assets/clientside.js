@@ -0,0 +1,248 @@
+// Sheets 2 to 4 drawn in the browser. By default the server sends the data of the traces of their figures in
+// "<prefix>-traces" (patchFigures). When it runs with GODELICIOUS_CLIENTSIDE_CALLBACKS=1 they are drawn from the
+// totals of "clientside-data" (see clientside_payload in main.py), and selections with secondary filters or a range
+// of months, and every selection before the totals arrive, are asked to the server through "<prefix>-request"
+(function () {
+    var COLORS = ["warning", "secondary", "primary", "success", "danger"];
+
+    function component(type, namespace, props) {
+        return {type: type, namespace: namespace, props: props};
+    }
+
+    // Same components as make_cards
+    function makeCards(cards) {
+        return component("Row", "dash_bootstrap_components", {
+            children: cards.map(function (card) {
+                return component("Col", "dash_bootstrap_components", {
+                    children: component("Card", "dash_bootstrap_components", {
+                        children: [
+                            component("CardHeader", "dash_bootstrap_components", {children: card[0]}),
+                            component("CardBody", "dash_bootstrap_components", {
+                                children: [
+                                    component("H5", "dash_html_components", {children: card[1], className: "card-title"}),
+                                    component("P", "dash_html_components", {children: card[2]})
+                                ]
+                            })
+                        ],
+                        color: COLORS[Math.floor(Math.random() * COLORS.length)],
+                        outline: true
+                    })
+                });
+            })
+        });
+    }
+
+    // Sales written as the server writes a float
+    function formatSales(value) {
+        return Number.isInteger(value) && Math.abs(value) < 1e16 ? value + ".0" : String(value);
+    }
+
+    function ordinal(place) {
+        var suffix = "th";
+        if (Math.floor(place / 10) % 10 !== 1) {
+            suffix = {1: "st", 2: "nd", 3: "rd"}[place % 10] || "th";
+        }
+        return place + suffix;
+    }
+
+    function selection(values) {
+        if (values === null || values === undefined) {
+            return [];
+        }
+        return (Array.isArray(values) ? values.slice() : [values]).sort();
+    }
+
+    // Sum of the totals of every selected key, per label
+    function sumTotals(entries, field) {
+        var totals = {};
+        entries.forEach(function (entry) {
+            var values = entry[field] || {};
+            Object.keys(values).forEach(function (label) {
+                totals[label] = (totals[label] || 0) + values[label];
+            });
+        });
+        return totals;
+    }
+
+    function sortedPairs(totals, ascending) {
+        var pairs = Object.keys(totals).map(function (label) { return [label, totals[label]]; });
+        pairs.sort(function (a, b) { return ascending ? a[1] - b[1] : b[1] - a[1]; });
+        return pairs;
+    }
+
+    function total(entries) {
+        if (entries.length === 1) {
+            return entries[0].total;
+        }
+        return entries.reduce(function (sum, entry) { return sum + entry.total; }, 0);
+    }
+
+    function figure(template, update) {
+        var copy = JSON.parse(JSON.stringify(template));
+        update(copy.data);
+        return copy;
+    }
+
+    // Outputs of a sheet: drawn from the totals, taken from the answer of the server or asked to it
+    function sheet(draw, outputs) {
+        return function () {
+            var args = Array.prototype.slice.call(arguments);
+            var filters = args.slice(0, -5);
+            var months = args[args.length - 5], results = args[args.length - 4], data = args[args.length - 3];
+            var min = args[args.length - 2], max = args[args.length - 1];
+            var noUpdate = window.dash_clientside.no_update;
+            var unchanged = [];
+            for (var index = 0; index < outputs; index++) {
+                unchanged.push(noUpdate);
+            }
+
+            var partialRange = months && (months[0] > min || months[1] < max);
+            var request = filters.concat([partialRange ? months : null]);
+            var key = JSON.stringify(request);
+            var triggered = window.dash_clientside.callback_context.triggered.map(function (trigger) {
+                return trigger.prop_id;
+            });
+            if (triggered.length === 1 && triggered[0].endsWith("-results.data")) {
+                if (!results || results.key !== key) {
+                    return unchanged.concat([noUpdate]);
+                }
+                return results.outputs.concat([noUpdate]);
+            }
+
+            var secondary = filters.slice(1).some(function (values) { return selection(values).length; });
+            var keys = selection(filters[0]);
+            var drawn = data && !secondary && !partialRange && keys.length ? draw(data, keys) : undefined;
+            if (drawn === undefined) {
+                return unchanged.concat([{key: key, args: request}]);
+            }
+            drawn[0] = makeCards(drawn[0]);
+            return drawn.concat([noUpdate]);
+        };
+    }
+
+    // Entries of the selected keys, or undefined when one of them is not in the totals
+    function entriesOf(totals, keys) {
+        var entries = keys.map(function (key) { return totals[String(key)]; });
+        return entries.every(function (entry) { return entry !== undefined; }) ? entries : undefined;
+    }
+
+    function store(data, stores) {
+        var entries = entriesOf(data.stores, stores);
+        if (!entries) {
+            return undefined;
+        }
+        var families = sumTotals(entries, "families");
+        var types = entries.map(function (entry) { return entry.type; }).filter(function (type, index, all) {
+            return all.indexOf(type) === index;
+        }).sort();
+        var cards = [
+            ["Total number of sold product categories", "Product categories",
+             Object.keys(families).length + " products"],
+            ["Total number of sales made", "Sales", formatSales(total(entries)) + " sales"],
+            ["Store type of the selected store", "Type", types.join(", ") + " type"]
+        ];
+
+        var barchart = figure(data.templates.store[0], function (traces) {
+            traces.forEach(function (trace) {
+                var x = [], y = [];
+                data.years.forEach(function (year, index) {
+                    var sales = null;
+                    entries.forEach(function (entry) {
+                        var values = entry.sales[trace.name];
+                        if (values && values[index] !== null) {
+                            sales = (sales || 0) + values[index];
+                        }
+                    });
+                    if (sales !== null) {
+                        x.push(year);
+                        y.push(sales);
+                    }
+                });
+                trace.x = x;
+                trace.y = y;
+            });
+        });
+
+        // Largest categories plus "Other", as top_n
+        var pairs = sortedPairs(families, false);
+        if (data.pie_top_n && pairs.length > data.pie_top_n) {
+            var other = pairs.slice(data.pie_top_n).reduce(function (sum, pair) { return sum + pair[1]; }, 0);
+            pairs = pairs.slice(0, data.pie_top_n).concat([["Other", other]]);
+        }
+        var piechart = figure(data.templates.store[1], function (traces) {
+            traces[0].labels = pairs.map(function (pair) { return pair[0]; });
+            traces[0].values = pairs.map(function (pair) { return pair[1]; });
+        });
+        return [cards, barchart, piechart];
+    }
+
+    function state(data, states) {
+        var entries = entriesOf(data.states, states);
+        if (!entries) {
+            return undefined;
+        }
+        var categories = sortedPairs(sumTotals(entries, "family"), false);
+        var types = sumTotals(entries, "store_type");
+        var most = Math.max.apply(null, Object.keys(types).map(function (type) { return types[type]; }));
+        var stores = sortedPairs(sumTotals(entries, "store_nbr"), true).slice(-5);
+        var cards = [
+            ["Most profitable product category in the region", "Best product category", categories[0][0]],
+            ["Total number of sales made", "Sales", formatSales(total(entries)) + " sales"],
+            ["Most common type of store in the selected region", "Store type (most common)",
+             Object.keys(types).filter(function (type) { return types[type] === most; }).sort().map(
+                 function (type) { return type + " type"; })]
+        ];
+        var barchart = figure(data.templates.state[0], function (traces) {
+            traces[0].x = stores.map(function (pair) { return pair[1]; });
+            traces[0].y = stores.map(function (pair) { return pair[0]; });
+        });
+        return [cards, barchart];
+    }
+
+    function product(data, families) {
+        var entries = entriesOf(data.families, families);
+        if (!entries) {
+            if (families.some(function (family) { return data.families[String(family)]; })) {
+                return undefined;
+            }
+            // A product category without sales has no data, as on the server
+            return [data.no_data_cards, figure(data.templates.product[0], function (traces) {
+                traces[0].x = [];
+                traces[0].y = [];
+            })];
+        }
+        var states = sortedPairs(sumTotals(entries, "state"), false);
+        var cities = sortedPairs(sumTotals(entries, "city"), true).slice(-data.top_cities);
+        var cards = [
+            ["State in which the product was the most sold", "State (most successful)", states[0][0]],
+            ["Total number of sales made", "Sales", formatSales(total(entries)) + " sales"],
+            ["Place on the ranking of most profitable product", "Ranking categories",
+             entries.map(function (entry) { return ordinal(entry.place); }).join(", ") + " place"]
+        ];
+        var barchart = figure(data.templates.product[0], function (traces) {
+            traces[0].x = cities.map(function (pair) { return pair[1]; });
+            traces[0].y = cities.map(function (pair) { return pair[0]; });
+        });
+        return [cards, barchart];
+    }
+
+    // Figures of a sheet with the data of their traces sent by the server, as a partial update would
+    function patchFigures(traces) {
+        var figures = Array.prototype.slice.call(arguments, 1);
+        if (!traces) {
+            return figures.map(function () { return window.dash_clientside.no_update; });
+        }
+        return figures.map(function (figure, index) {
+            return Object.assign({}, figure, {
+                data: figure.data.map(function (trace, number) {
+                    return Object.assign({}, trace, traces[index][number]);
+                })
+            });
+        });
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        godelicious: {store: sheet(store, 3), state: sheet(state, 2), product: sheet(product, 2),
+                      patchFigures: patchFigures}
+    });
+})();
@@ -0,0 +1,270 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows, where the peak memory is not reported
+    resource = None
+
+# Benchmark of the report on synthetic Godelicious-like data: ingest, sheet 1 aggregation, every callback
+# for every dropdown value and the size of the serialized figures. Every scale runs in its own process,
+# so that its peak memory is measured on its own.
+#
+#   python benchmark.py --rows 1000000 10000000 50000000
+#   python benchmark.py --rows 1000000 --compare benchmark_results/results-20221201-120000.json
+
+RESULTS_DIR = "benchmark_results"
+GENERATE_CHUNK_ROWS = 1000000
+
+# Shape of the real data: stores, product categories, states, cities and store types
+STORES = 54
+FAMILIES = ["FAMILY %02d" % number for number in range(33)]
+STATES = ["State %02d" % number for number in range(16)]
+CITIES = ["City %02d" % number for number in range(22)]
+STORE_TYPES = ["A", "B", "C", "D", "E"]
+DATES = pd.date_range("2013-01-01", "2017-08-15", freq="D")
+
+
+# Rows are written in chunks, half of them to each of the two csv files the report reads
+def generate_data(rows, directory, seed=0):
+    generator = np.random.default_rng(seed)
+    stores = np.arange(1, STORES + 1)
+    store_city = np.array(CITIES, dtype=object)[stores % len(CITIES)]
+    store_state = np.array(STATES, dtype=object)[stores % len(STATES)]
+    store_type = np.array(STORE_TYPES, dtype=object)[stores % len(STORE_TYPES)]
+    written = 0
+    for file_name, file_rows in [("godelicious_1.csv", rows // 2), ("godelicious_2.csv", rows - rows // 2)]:
+        path = os.path.join(directory, file_name)
+        header = True
+        for start in range(0, file_rows, GENERATE_CHUNK_ROWS):
+            size = min(GENERATE_CHUNK_ROWS, file_rows - start)
+            dates = DATES[generator.integers(0, len(DATES), size)]
+            store = generator.integers(0, STORES, size)
+            holiday = generator.random(size) < 0.1
+            chunk = pd.DataFrame({
+                "id": np.arange(written, written + size),
+                "date": dates.strftime("%Y-%m-%d"),
+                "store_nbr": stores[store],
+                "family": np.array(FAMILIES, dtype=object)[generator.integers(0, len(FAMILIES), size)],
+                "sales": np.round(generator.gamma(1, 300, size) * (generator.random(size) > 0.3), 3),
+                "onpromotion": generator.integers(0, 5, size) * (generator.random(size) > 0.6),
+                "city": store_city[store],
+                "state": store_state[store],
+                "store_type": store_type[store],
+                "cluster": store % 17,
+                "holiday_type": np.where(holiday, "Holiday", None),
+                "locale": np.where(holiday, "National", None),
+                "locale_name": np.where(holiday, "Ecuador", None),
+                "description": np.where(holiday, "Synthetic holiday", None),
+                "transferred": np.where(holiday, "False", None),
+                "dcoilwtico": np.round(generator.random(size) * 100, 2),
+                "transactions": generator.integers(0, 3000, size),
+                "year": dates.year,
+                "month": dates.month,
+                "week": dates.isocalendar().week.to_numpy(dtype=np.int64),
+                "day_of_week": dates.day_name(),
+            })
+            chunk.to_csv(path, mode="w" if header else "a", header=header, index=False)
+            header = False
+            written += size
+
+
+def percentiles(seconds):
+    if not seconds:
+        return {}
+    milliseconds = np.array(seconds) * 1000
+    return {"calls": len(seconds),
+            "p50_ms": float(np.percentile(milliseconds, 50)),
+            "p95_ms": float(np.percentile(milliseconds, 95)),
+            "p99_ms": float(np.percentile(milliseconds, 99))}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+# Times and sizes of every callback for every value, first on a cold cache and then on a warm one
+def time_callback(callback, values, clear_caches):
+    from plotly.utils import PlotlyJSONEncoder
+    clear_caches()
+    cold, warm, sizes = [], [], []
+    for value in values:
+        start = time.perf_counter()
+        outputs = callback(value)
+        cold.append(time.perf_counter() - start)
+        sizes.append(len(json.dumps(outputs, cls=PlotlyJSONEncoder)))
+    for value in values:
+        start = time.perf_counter()
+        callback(value)
+        warm.append(time.perf_counter() - start)
+    return {"cold": percentiles(cold),
+            "warm": percentiles(warm),
+            "bytes": {"mean": float(np.mean(sizes)), "max": int(np.max(sizes))}}
+
+
+def time_repeated(function, repeat=3):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+# Runs in a separate process for every scale, with the data directory set before the report is imported
+def run_scale(directory):
+    import logging
+    logging.disable(logging.INFO)
+    start = time.perf_counter()
+    import main
+    result = {"import_s": time.perf_counter() - start,
+              "startup_stages_s": dict(main.stage_timings)}
+    if not main.STREAMING_CHUNK_SIZE:
+        result["cached_load_s"] = time_repeated(main.load_dataframe, repeat=1)
+        # The report keeps only the aggregates, so the data is loaded again from the cache to time them
+        frame = main.load_dataframe()
+        result["sheet_1_aggregation_s"] = time_repeated(lambda: main.sheet_1_tables(main.sheet_1_partials(frame)))
+        result["cube_s"] = time_repeated(lambda: main.sales_cube(frame))
+        del frame
+    result["sheet_1_figures_s"] = time_repeated(lambda: main.build_sheet_1_figures("serial"))
+    sheet_1_sizes = [len(json.dumps(figure)) for figure in main.sheet_1_figures.values()]
+    result["sheet_1_bytes"] = int(np.sum(sheet_1_sizes))
+    states = [str(state) for state in main.dimensions["state"]]
+    families = [str(family) for family in main.dimensions["family"]]
+    years = [int(year) for year in main.dimensions["year"]]
+    result["callbacks"] = {
+        "update_charts_sheet_2": time_callback(lambda store: main.update_charts_sheet_2([store]),
+                                               [int(store) for store in main.dimensions["store_nbr"]],
+                                               main.clear_callback_caches),
+        "update_charts_sheet_3": time_callback(lambda state: main.update_charts_sheet_3([state]),
+                                               states, main.clear_callback_caches),
+        "update_charts_sheet_4": time_callback(lambda family: main.update_charts_sheet_4([family]),
+                                               families, main.clear_callback_caches),
+        # Combined filters: two states, three product families and the last year
+        "update_charts_sheet_3_combined": time_callback(
+            lambda start: main.update_charts_sheet_3(states[start:start + 2], families[start:start + 3], years[-1:]),
+            list(range(len(states) - 1)), main.clear_callback_caches),
+        # Date ranges starting every three months and ending with the data
+        "update_charts_sheet_1_range": time_callback(
+            lambda start: main.update_charts_sheet_1([start, main.date_range[1]]),
+            list(range(main.date_range[0] + 1, main.date_range[1], 3)), main.clear_callback_caches),
+        "update_charts_sheet_3_range": time_callback(
+            lambda start: main.update_charts_sheet_3(states[:1], None, None, [start, main.date_range[1]]),
+            list(range(main.date_range[0] + 1, main.date_range[1], 3)), main.clear_callback_caches),
+        "update_charts_sheet_5": time_callback(lambda store: main.update_charts_sheet_5([store]),
+                                               [int(store) for store in main.dimensions["store_nbr"]],
+                                               main.clear_callback_caches),
+        "update_store_options": time_callback(lambda state: main.update_store_options([state], [1]),
+                                              states, main.clear_callback_caches),
+    }
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def benchmark(rows, keep_data=False):
+    directory = tempfile.mkdtemp(prefix="godelicious-benchmark-")
+    start = time.perf_counter()
+    generate_data(rows, directory)
+    print("%d rows generated in %.1f s" % (rows, time.perf_counter() - start), file=sys.stderr)
+    environment = dict(os.environ, GODELICIOUS_DATA_DIR=directory,
+                       GODELICIOUS_CACHE_DIR=os.path.join(directory, ".godelicious_cache"))
+    environment.pop("GODELICIOUS_DELTA_DIR", None)
+    try:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--scale-worker", directory],
+                                env=environment, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                check=True, capture_output=True, text=True).stdout
+    except subprocess.CalledProcessError as error:
+        # The traceback of the worker is in its captured stderr
+        raise RuntimeError("benchmark of %d rows failed with exit code %d:\n%s"
+                           % (rows, error.returncode, error.stderr)) from error
+    finally:
+        if not keep_data:
+            shutil.rmtree(directory, ignore_errors=True)
+    result = json.loads(output)
+    result["rows"] = rows
+    return result
+
+
+# Flattened numeric values of a result, so that two runs can be compared key by key
+def flatten(result, prefix=""):
+    values = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[prefix + key] = value
+    return values
+
+
+def compare(current, previous):
+    for scale, result in current["scales"].items():
+        if scale not in previous["scales"]:
+            continue
+        print("\n%s rows, compared with %s" % (scale, previous["date"]))
+        before = flatten(previous["scales"][scale])
+        for key, value in flatten(result).items():
+            if key in before and before[key]:
+                print("  %-55s %12.3f %12.3f  x%.2f" % (key, before[key], value, value / before[key]))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Godelicious report on synthetic data.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000000],
+                        help="number of rows of every scale to benchmark (default: 1000000)")
+    parser.add_argument("--output", default=RESULTS_DIR, help="directory where the results are saved")
+    parser.add_argument("--compare", help="results file of a previous run to compare with")
+    parser.add_argument("--keep-data", action="store_true", help="do not delete the generated csv files")
+    parser.add_argument("--scale-worker", help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.scale_worker:
+        print(json.dumps(run_scale(arguments.scale_worker)))
+        return
+
+    now = datetime.datetime.now()
+    results = {"date": now.isoformat(timespec="seconds"),
+               "commit": git_commit(),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "cpus": os.cpu_count(),
+               "scales": {}}
+    for rows in arguments.rows:
+        results["scales"][str(rows)] = benchmark(rows, keep_data=arguments.keep_data)
+
+    os.makedirs(arguments.output, exist_ok=True)
+    path = os.path.join(arguments.output, now.strftime("results-%Y%m%d-%H%M%S.json"))
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+    print(json.dumps(results, indent=2))
+    print("Results saved to " + path, file=sys.stderr)
+
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
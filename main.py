@@ -1,20 +1,415 @@
-from dash import Dash, html, dcc
+from dash import ClientsideFunction, Dash, DiskcacheManager, html, dcc, ctx, no_update
+import argparse
+import calendar
+import contextlib
+import bisect
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
+import flask
+from dash.dependencies import Input, Output, State
+import concurrent.futures
+import functools
+import glob
+import hashlib
+import json
+import logging
+import multiprocessing
+import multiprocessing.connection
 import numpy as np
+import os
 import pandas as pd
 import plotly.express as px
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
 import random
+import re
+import shutil
+import sys
+import threading
+import time
+from xml.sax.saxutils import escape
 
-# Fixing dtypes of some troublesome columns...
+try:
+    import fcntl
+except ImportError:  # Windows, where the cache is built without locking
+    fcntl = None
+
+try:
+    import diskcache
+except ImportError:  # only needed by the background callbacks
+    diskcache = None
+
+try:
+    import resource
+except ImportError:  # Windows, where the peak memory is not reported
+    resource = None
+
+try:
+    import orjson
+except ImportError:  # figures and callback responses are serialized by the json module
+    orjson = None
+
+# Fixing dtypes of some troublesome columns, and reading the others with the dtype they are kept in...
 dtypes = {'holiday_type': object, 'locale': object,
           'locale_name': object, 'description': object,
-          'transferred': object}
+          'transferred': object, 'date': object,
+          'store_nbr': np.int64, 'sales': np.float64,
+          'onpromotion': np.int64, 'year': np.int64,
+          'month': np.int64, 'week': np.int64,
+          'family': 'category', 'city': 'category',
+          'state': 'category', 'store_type': 'category',
+          'day_of_week': 'category'}
+
+# Data files and columnar cache of the parsed data
+DATA_DIR = os.environ.get("GODELICIOUS_DATA_DIR", ".")
+CSV_FILES = ["godelicious_1.csv", "godelicious_2.csv"]
+CACHE_DIR = os.environ.get("GODELICIOUS_CACHE_DIR", os.path.join(DATA_DIR, ".godelicious_cache"))
+CACHE_VERSION = 4
+
+# Serving several worker processes (e.g. "gunicorn -w 8 main:server"): the cached columns are memory-mapped
+# read-only, so that every worker shares the same pages of the dataset instead of holding its own copy
+SHARED_DATA = os.environ.get("GODELICIOUS_SHARED_DATA", "0") == "1"
+
+# Streaming ingestion for datasets larger than memory: when set, the csv files are read in chunks of this
+# many rows and folded straight into the aggregates of the dashboard, without ever building the dataframe
+STREAMING_CHUNK_SIZE = int(os.environ.get("GODELICIOUS_STREAMING_CHUNK_SIZE", "0"))
+
+# Incremental updates: new daily sales csv files moved into this directory are merged into the aggregates
+# of the running report, which looks for them every DELTA_INTERVAL seconds
+DELTA_DIR = os.environ.get("GODELICIOUS_DELTA_DIR")
+DELTA_INTERVAL = int(os.environ.get("GODELICIOUS_DELTA_INTERVAL", "60"))
+
+# Columns of the csv files every aggregate is built from, and so the figures and callbacks built on it. Only
+# these columns are parsed and loaded; any other one is read the first time data_column asks for it
+COLUMN_DEPENDENCIES = {
+    # Figures and cards of sheet 1
+    "sheet_1_partials": ["day_of_week", "week", "month", "year", "family", "store_type", "store_nbr", "state",
+                         "city", "sales", "onpromotion"],
+    # Callbacks and dropdowns of sheets 2 to 4
+    "sales_cube": ["store_nbr", "family", "year", "month", "onpromotion", "city", "state", "store_type", "sales"],
+    # Callback of sheet 5
+    "holiday_aggregates": ["date", "store_nbr", "family", "year", "month", "sales", "holiday_type", "locale",
+                           "locale_name", "description", "transferred"],
+    # Default values of the dropdowns of sheets 3 and 4
+    "first_row": ["state", "family"],
+}
+AGGREGATE_COLUMNS = list(dict.fromkeys(column for columns in COLUMN_DEPENDENCIES.values() for column in columns))
+
+# Text columns with fewer distinct values than this share of rows are stored as categoricals
+CATEGORY_RATIO = 0.5
+# Float columns kept in double precision, so that the reported totals do not change
+EXACT_COLUMNS = ["sales"]
+
+# Snapshot of the cards and figures of sheet 1, saved for the csv files and settings they were built from.
+# When it is up to date the server starts with it, and the data is loaded in the background (or, with
+# GODELICIOUS_PRELOAD_REPORT=0, the first time another sheet needs it)
+SNAPSHOT_FILE = os.environ.get("GODELICIOUS_SNAPSHOT_FILE", CACHE_DIR + ".sheet_1.json")
+SNAPSHOT_VERSION = 1
+PRELOAD_REPORT = os.environ.get("GODELICIOUS_PRELOAD_REPORT", "1") == "1"
+
+# Startup pipeline: the figures of sheet 1 are built concurrently in a "thread" or "process" pool (or "serial"),
+# and the time of every stage is logged
+PRELOAD_POOL = os.environ.get("GODELICIOUS_PRELOAD_POOL", "thread")
+PRELOAD_WORKERS = int(os.environ.get("GODELICIOUS_PRELOAD_WORKERS", str(os.cpu_count() or 1)))
+
+# Size limits of the figures sent to the browser: slices of a pie chart beyond the top PIE_TOP_N are shown together
+# as "Other", and line charts with more than MAX_LINE_POINTS points are averaged down to that many (0 disables them)
+PIE_TOP_N = int(os.environ.get("GODELICIOUS_PIE_TOP_N", "15"))
+MAX_LINE_POINTS = int(os.environ.get("GODELICIOUS_MAX_LINE_POINTS", "500"))
+
+# Number of dropdown values whose cards and figures are kept by each callback, and whether all
+# of them are computed at startup
+CALLBACK_CACHE_SIZE = int(os.environ.get("GODELICIOUS_CALLBACK_CACHE_SIZE", "128"))
+WARM_CALLBACK_CACHES = os.environ.get("GODELICIOUS_WARM_CALLBACK_CACHES", "0") == "1"
+
+# Background callbacks: with GODELICIOUS_BACKGROUND_CALLBACKS=1 the callbacks of the sheets run in worker processes
+# managed by Dash with a local diskcache (pip install "dash[diskcache]"), so that a slow selection does not hold a
+# server thread. Results are shared through the cache for BACKGROUND_EXPIRE seconds, and an identical selection
+# requested while it is computed waits for it instead of computing it again
+BACKGROUND_CALLBACKS = os.environ.get("GODELICIOUS_BACKGROUND_CALLBACKS", "0") == "1"
+BACKGROUND_CACHE_DIR = os.environ.get("GODELICIOUS_BACKGROUND_CACHE_DIR", CACHE_DIR + "_callbacks")
+BACKGROUND_EXPIRE = int(os.environ.get("GODELICIOUS_BACKGROUND_EXPIRE", "3600"))
+
+# Client-side switching: with GODELICIOUS_CLIENTSIDE_CALLBACKS=1 the browser gets the totals of every store, state
+# and product category once per session and draws sheets 2 to 4 itself (assets/clientside.js), so that changing
+# the dropdowns needs neither the server nor the network. Selections with secondary filters or a range of months
+# are still computed by the server
+CLIENTSIDE_CALLBACKS = os.environ.get("GODELICIOUS_CLIENTSIDE_CALLBACKS", "0") == "1"
+
+# Instrumentation: latency histograms of every stage, callback and request are served in the Prometheus text
+# format on METRICS_ROUTE (empty disables it). With GODELICIOUS_TRACE_CALLBACKS=1 the steps of every callback
+# (filter, groupby, figures, serialization) are timed as well and logged per request
+METRICS_ROUTE = os.environ.get("GODELICIOUS_METRICS_ROUTE", "/metrics")
+TRACE_CALLBACKS = os.environ.get("GODELICIOUS_TRACE_CALLBACKS", "0") == "1"
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+logger = logging.getLogger("godelicious")
+startup_time = time.perf_counter()
+# Duration in seconds of the last run of every stage
+stage_timings = {}
+
+
+# Upper bounds in seconds of the buckets of the histograms, the last one being +Inf
+HISTOGRAM_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+# Histogram of every metric and set of labels: count per bucket, total count and sum of the observations
+histograms = {}
+histograms_lock = threading.Lock()
+
+
+def observe(metric, labels, seconds):
+    key = (metric, tuple(sorted(labels.items())))
+    with histograms_lock:
+        if key not in histograms:
+            histograms[key] = {"buckets": [0] * len(HISTOGRAM_BUCKETS), "count": 0, "sum": 0.0}
+        histogram = histograms[key]
+        bucket = bisect.bisect_left(HISTOGRAM_BUCKETS, seconds)
+        if bucket < len(HISTOGRAM_BUCKETS):
+            histogram["buckets"][bucket] += 1
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+
+
+@contextlib.contextmanager
+def timed_stage(name):
+    start = time.perf_counter()
+    yield
+    stage_timings[name] = time.perf_counter() - start
+    observe("godelicious_stage_seconds", {"stage": name}, stage_timings[name])
+    logger.info("%s: %.3f s", name, stage_timings[name])
+
+
+# Steps of the callback running in the current thread, only kept when tracing
+request_trace = threading.local()
+NO_TRACE = contextlib.nullcontext()
+
+
+@contextlib.contextmanager
+def traced_step(step):
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    request_trace.steps.append((step, seconds))
+    observe("godelicious_callback_step_seconds", {"callback": request_trace.callback, "step": step}, seconds)
+
+
+# A step of a callback, timed only when tracing (and within a callback) so that it costs nothing otherwise
+def traced(step):
+    if TRACE_CALLBACKS and getattr(request_trace, "steps", None) is not None:
+        return traced_step(step)
+    return NO_TRACE
+
+
+# Latency of every call of a callback, and its steps logged when tracing
+def instrumented(callback):
+    @functools.wraps(callback)
+    def wrapper(*args):
+        if TRACE_CALLBACKS:
+            request_trace.callback, request_trace.steps = callback.__name__, []
+        start = time.perf_counter()
+        try:
+            return callback(*args)
+        finally:
+            seconds = time.perf_counter() - start
+            observe("godelicious_callback_seconds", {"callback": callback.__name__}, seconds)
+            if TRACE_CALLBACKS:
+                steps = ", ".join("%s %.3f s" % step for step in request_trace.steps) or "cached"
+                logger.info("trace %s%r: %.3f s (%s)", callback.__name__, args, seconds, steps)
+                request_trace.steps = None
+    return wrapper
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha1.update(block)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": sha1.hexdigest()}
+
+
+# A source is unchanged if its size and mtime match, or if it was only touched and its hash still matches.
+# Returns whether they are all unchanged and whether the mtime of any of them was updated
+def sources_are_fresh(sources, paths):
+    if len(sources) != len(paths):
+        return False, False
+    touched = False
+    for source, path in zip(sources, paths):
+        stat = os.stat(path)
+        if source["size"] == stat.st_size and source["mtime_ns"] == stat.st_mtime_ns:
+            continue
+        if source["sha1"] != file_fingerprint(path)["sha1"]:
+            return False, touched
+        source["mtime_ns"] = stat.st_mtime_ns
+        touched = True
+    return True, touched
+
+
+def cache_is_fresh(meta, paths):
+    if meta.get("version") != CACHE_VERSION:
+        return False
+    fresh, touched = sources_are_fresh(meta["sources"], paths)
+    if fresh and touched:
+        # Other processes read it without the cache lock, so it is never left half written
+        write_file_atomically(os.path.join(CACHE_DIR, "meta.json"), json.dumps(meta))
+    return fresh
+
+
+# Categorical text columns and downcast numeric columns
+def compact_dataframe(frame):
+    for column in frame.columns:
+        series = frame[column]
+        if series.dtype == object:
+            if series.nunique() < CATEGORY_RATIO * len(series):
+                frame[column] = series.astype("category")
+        elif pd.api.types.is_integer_dtype(series):
+            frame[column] = pd.to_numeric(series, downcast="integer")
+        elif pd.api.types.is_float_dtype(series) and column not in EXACT_COLUMNS:
+            frame[column] = pd.to_numeric(series, downcast="float")
+    return frame
+
+
+# One .npy file per column (codes and categories for categoricals). A new cache is written to a temporary
+# directory first so that a half written cache is never read, and columns added to an up to date cache are
+# only listed in its meta.json once their files are written. Returns the meta of the cache
+def write_cache(frame, paths, meta=None):
+    if meta is None:
+        directory = "%s.tmp-%d" % (CACHE_DIR, os.getpid())
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        meta = {"version": CACHE_VERSION,
+                "sources": [file_fingerprint(path) for path in paths],
+                "rows": len(frame),
+                "columns": []}
+    else:
+        directory = CACHE_DIR
+        meta = dict(meta, columns=list(meta["columns"]))
+    for column in frame.columns:
+        series = frame[column]
+        file_name = "%03d" % len(meta["columns"])
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(directory, file_name + ".npy"), series.cat.codes.to_numpy())
+            np.save(os.path.join(directory, file_name + ".categories.npy"),
+                    series.cat.categories.to_numpy(dtype=object), allow_pickle=True)
+            meta["columns"].append({"name": column, "file": file_name, "categorical": True, "objects": False})
+        else:
+            np.save(os.path.join(directory, file_name + ".npy"), series.to_numpy(), allow_pickle=True)
+            meta["columns"].append({"name": column, "file": file_name, "categorical": False,
+                                    "objects": bool(series.dtype == object)})
+    if directory == CACHE_DIR:
+        write_file_atomically(os.path.join(CACHE_DIR, "meta.json"), json.dumps(meta))
+        return meta
+    with open(os.path.join(directory, "meta.json"), "w") as file:
+        json.dump(meta, file)
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+    os.rename(directory, CACHE_DIR)
+    return meta
+
+
+def read_cache_meta(paths):
+    try:
+        with open(os.path.join(CACHE_DIR, "meta.json")) as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+    return meta if cache_is_fresh(meta, paths) else None
+
+
+# Columns derived from a column of the csv files, which are cached and loaded along with it
+DERIVED_COLUMNS = {"promoted": "onpromotion"}
+
+
+def read_cache(meta, columns):
+    values = {}
+    for column in meta["columns"]:
+        if column["name"] not in columns and DERIVED_COLUMNS.get(column["name"]) not in columns:
+            continue
+        # Python objects can not be memory-mapped, so those columns are always read into memory
+        mmap_mode = "r" if SHARED_DATA and not column["objects"] else None
+        array = np.load(os.path.join(CACHE_DIR, column["file"] + ".npy"), mmap_mode=mmap_mode, allow_pickle=True)
+        if column["categorical"]:
+            categories = np.load(os.path.join(CACHE_DIR, column["file"] + ".categories.npy"), allow_pickle=True)
+            array = pd.Categorical.from_codes(array, categories=categories)
+        values[column["name"]] = array
+    return pd.DataFrame(values, copy=False)
+
+
+def missing_columns(meta, columns):
+    cached = set() if meta is None else {column["name"] for column in meta["columns"]}
+    return [column for column in columns if column not in cached]
+
+
+# Only one process at a time builds the cache, the others wait for it and then read it
+@contextlib.contextmanager
+def cache_lock():
+    try:
+        lock_file = open(CACHE_DIR + ".lock", "w")
+    except OSError:
+        yield
+        return
+    with lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+# Only the given columns of the csv files are parsed, with the promotion status derived from "onpromotion"
+def parse_columns(paths, columns):
+    frame = pd.concat([pd.read_csv(path, dtype=dtypes, usecols=columns) for path in paths], axis=0,
+                      ignore_index=True)
+    frame = compact_dataframe(frame)
+    if "onpromotion" in frame:
+        # Promotion status, as bool(onpromotion) but vectorized and stored along the other columns
+        frame["promoted"] = frame["onpromotion"] != 0
+    return frame
+
+
+# Reading columns of the csv files from the cache if it is up to date and has them. The missing ones are parsed
+# and added to it, and a cache of csv files that changed is replaced by one with only the parsed columns
+def load_columns(columns):
+    paths = csv_paths()
+    meta = read_cache_meta(paths)
+    if not missing_columns(meta, columns):
+        return read_cache(meta, columns)
+    with cache_lock():
+        meta = read_cache_meta(paths)
+        missing = missing_columns(meta, columns)
+        if not missing:
+            return read_cache(meta, columns)
+        parsed = parse_columns(paths, missing)
+        try:
+            new_meta = write_cache(parsed, paths, meta)
+        except OSError:
+            new_meta = None
+    # The freshly parsed columns are private to this process, the shared ones are the memory-mapped cache
+    if SHARED_DATA and new_meta is not None:
+        return read_cache(new_meta, columns)
+    if len(missing) == len(columns):
+        return parsed
+    return pd.concat([read_cache(meta, [column for column in columns if column not in missing]), parsed], axis=1)
+
+
+# Reading the columns the aggregates depend on, from the csv files or from the cache if it is up to date...
+def load_dataframe():
+    return load_columns(AGGREGATE_COLUMNS)
+
+
+# Times the data and aggregates were loaded by load_report. The loaded columns are dropped once the aggregates
+# are built from them
+data_loaded_at = None
+report_refreshed_at = None
+
+# Columns of the csv files asked for after the aggregates are built, read from the columnar cache (and parsed
+# into it when it does not have them yet) the first time they are asked for
+lazy_columns = {}
+lazy_columns_lock = threading.Lock()
+
+
+def data_column(column):
+    with lazy_columns_lock:
+        if column not in lazy_columns:
+            with timed_stage("load column " + column):
+                lazy_columns[column] = load_columns([column])[column]
+        return lazy_columns[column]
 
-# Reading csv files and concatenating dataframes...
-dataframe_1 = pd.read_csv("godelicious_1.csv", dtype=dtypes)
-dataframe_2 = pd.read_csv("godelicious_2.csv", dtype=dtypes)
-dataframe = pd.concat([dataframe_1, dataframe_2], axis=0)
 
 # External CSS stylesheets
 external_stylesheets = [
@@ -26,817 +421,2261 @@ external_stylesheets = [
     dbc.themes.BOOTSTRAP,
 ]
 
+# Sheet 1 aggregates, computed with one factorization per column and one np.bincount per set of keys
+# instead of a full groupby over the dataframe for every figure and card
+def factorize_columns(frame, columns):
+    factors = {}
+    for column in columns:
+        codes, levels = pd.factorize(frame[column], sort=True)
+        factors[column] = (codes, np.asarray(levels))
+    return factors
+
+
+# Sums of the weights and number of rows for every observed combination of the keys, indexed by their labels
+def group_sums(factors, keys, weights, rows_mask=None):
+    codes = [factors[key][0] for key in keys]
+    levels = [factors[key][1] for key in keys]
+    shape = [len(level) for level in levels]
+    combined = np.ravel_multi_index(codes, shape) if len(keys) > 1 else codes[0]
+    size = int(np.prod(shape))
+    if rows_mask is not None:
+        weights = np.where(rows_mask, weights, 0)
+    rows = np.bincount(combined, weights=rows_mask, minlength=size)
+    sums = np.bincount(combined, weights=weights, minlength=size)
+    observed = np.flatnonzero(rows)
+    if len(keys) > 1:
+        positions = np.unravel_index(observed, shape)
+        index = pd.MultiIndex.from_arrays([level[position] for level, position in zip(levels, positions)],
+                                          names=keys)
+    else:
+        index = pd.Index(levels[0][observed], name=keys[0])
+    return pd.Series(sums[observed], index=index), pd.Series(rows[observed].astype(np.int64), index=index)
+
+
+# Every partial is also split by year and month, so that sheet 1 can be limited to a range of months
+def sheet_1_partials(frame):
+    factors = factorize_columns(frame, ["day_of_week", "week", "month", "year", "family", "store_type",
+                                        "store_nbr", "state", "city"])
+    sales = frame["sales"].fillna(0).to_numpy(dtype=np.float64)
+    months = ["year", "month"]
+    partials = {}
+    partials["day_sales"], partials["day_rows"] = group_sums(factors, ["day_of_week"] + months, sales)
+    partials["week_year_sales"], _ = group_sums(factors, ["week"] + months, sales)
+    partials["month_year_sales"], _ = group_sums(factors, ["month", "year"], sales)
+    partials["family_sales"], _ = group_sums(factors, ["family"] + months, sales)
+    partials["promo_family_sales"], _ = group_sums(factors, ["family"] + months, sales,
+                                                   rows_mask=frame["promoted"].to_numpy())
+    partials["store_type_sales"], _ = group_sums(factors, ["store_type"] + months, sales)
+    for key, name in [("store_nbr", "store_rows"), ("state", "state_rows"), ("city", "city_rows")]:
+        _, partials[name] = group_sums(factors, [key] + months, sales)
+    return partials
+
+
+# Keys every partial is summed by once the months out of the range are left out
+PARTIAL_KEYS = {"day_sales": ["day_of_week"], "day_rows": ["day_of_week"], "week_year_sales": ["week", "year"],
+                "month_year_sales": ["month", "year"], "family_sales": ["family"],
+                "promo_family_sales": ["family"], "store_type_sales": ["store_type"],
+                "store_rows": ["store_nbr"], "state_rows": ["state"], "city_rows": ["city"]}
+
+
+# Month of the data as a number of months since year 0, the unit of the date range
+def period_of(year, month):
+    return year * 12 + month - 1
+
+
+def period_partials(partials, period_range=None):
+    summed = {}
+    for name, series in partials.items():
+        if period_range is not None:
+            periods = period_of(np.asarray(series.index.get_level_values("year"), dtype=np.int64),
+                                np.asarray(series.index.get_level_values("month"), dtype=np.int64))
+            series = series[(periods >= period_range[0]) & (periods <= period_range[1])]
+        summed[name] = series.groupby(level=PARTIAL_KEYS[name]).sum()
+    return summed
+
+
+# Tables and card values of sheet 1 over the given range of months (all of them by default), as the former
+# groupby calls used to produce them
+def sheet_1_tables(partials, period_range=None):
+    partials = period_partials(partials, period_range)
+    tables = {}
+    week_days = partials["day_sales"] / partials["day_rows"]
+    tables["week_days"] = week_days.rename("avg_sales").reset_index()
+
+    for period, name in [("week", "weeks"), ("month", "months")]:
+        period_year = partials[period + "_year_sales"]
+        period_sales = period_year.groupby(level=period).agg(["mean", "max"])
+        period_sales.columns = ["avg_sales", "max_sales"]
+        tables[name] = period_sales.reset_index()
+
+    products = partials["family_sales"].rename("sales").reset_index()
+    products.sort_values(by="sales", ascending=True, ignore_index=True, inplace=True)
+    tables["products"] = products
+    prom_prod = partials["promo_family_sales"].rename("sales").reset_index()
+    prom_prod.sort_values(by="sales", ascending=True, ignore_index=True, inplace=True)
+    tables["prom_prod"] = prom_prod
+    tables["store_types"] = partials["store_type_sales"].rename("sales").reset_index()
+
+    tables["counts"] = {"stores": len(partials["store_rows"]),
+                        "families": len(partials["family_sales"]),
+                        "years": partials["month_year_sales"].index.get_level_values("year").nunique(),
+                        "states": len(partials["state_rows"]),
+                        "cities": len(partials["city_rows"]),
+                        "months": len(partials["month_year_sales"])}
+    return tables
+
+
+# Sum partials of two parts of the data, as if they had been computed over both at once
+def merge_partials(left, right):
+    return {name: left[name].add(right[name], fill_value=0) for name in left}
+
+
+# Aggregate cube of the sales, so that the callbacks of sheets 2, 3 and 4 never scan the whole dataframe.
+# City, state and store type depend on the store only, so they do not make the cube any bigger.
+# Every measure is kept for the whole year and for each of its months ("sales_01" to "sales_12"),
+# which is what a range of months is computed from
+CUBE_KEYS = ["store_nbr", "family", "year", "promoted", "city", "state", "store_type"]
+CUBE_MEASURES = ["sales", "sold_rows", "rows"]
+MONTHS = list(range(1, 13))
+
+
+def month_columns(measure):
+    return ["%s_%02d" % (measure, month) for month in MONTHS]
+
+
+def sales_cube(frame):
+    values = pd.DataFrame({"sales": frame["sales"],
+                           "sold_rows": frame["sales"] != 0})
+    groups = values.groupby(by=[frame[key] for key in CUBE_KEYS] + [frame["month"].rename("month")],
+                            observed=True)
+    monthly = groups.sum()
+    monthly["rows"] = groups.size()
+    monthly = monthly.unstack("month", fill_value=0)
+    cube = pd.DataFrame({measure: monthly[measure].sum(axis=1) for measure in CUBE_MEASURES})
+    for measure in CUBE_MEASURES:
+        by_month = monthly[measure].reindex(columns=MONTHS, fill_value=0)
+        cube[month_columns(measure)] = by_month.to_numpy()
+    return cube.reset_index()
+
+
+def merge_cubes(left, right):
+    return pd.concat([left, right], ignore_index=True).groupby(by=CUBE_KEYS, as_index=False, observed=True).sum()
+
+
+# Holiday sheet aggregates: the sales of every store, product category and month split by the holiday of their
+# rows, and the holiday calendar of the stores, one row per store, day and holiday, which the days are counted
+# from. Both keep the attributes of the holidays, "" on days without one, so that chunks and delta files merge
+HOLIDAY_KEYS = ["holiday_type", "locale", "locale_name", "description", "transferred"]
+HOLIDAY_SALES_KEYS = ["store_nbr", "family", "year", "month"] + HOLIDAY_KEYS
+HOLIDAY_CALENDAR_KEYS = ["date", "store_nbr", "year", "month"] + HOLIDAY_KEYS
+
+
+def holiday_aggregates(frame):
+    # One code per combination of the attributes of the rows, the attributes being factorized column by column
+    factors = factorize_columns(frame, HOLIDAY_KEYS)
+    shape = [len(levels) + 1 for _, levels in factors.values()]
+    combined = np.ravel_multi_index([codes + 1 for codes, _ in factors.values()], shape)
+    codes, combinations = pd.factorize(combined)
+    positions = np.unravel_index(combinations, shape)
+    holidays = pd.DataFrame({key: np.append([""], levels.astype(str))[position]
+                             for (key, (_, levels)), position in zip(factors.items(), positions)})
+    holiday = pd.Series(codes, index=frame.index, name="holiday")
+
+    sales = frame["sales"].groupby(by=[frame[key] for key in HOLIDAY_SALES_KEYS[:4]] + [holiday], observed=True).sum()
+    sales = sales.reset_index().join(holidays, on="holiday").drop(columns="holiday")
+    calendar = pd.concat([frame[HOLIDAY_CALENDAR_KEYS[:4]], holiday], axis=1).drop_duplicates()
+    calendar = calendar.join(holidays, on="holiday").drop(columns="holiday")
+    calendar["date"] = calendar["date"].astype(str)
+    return sales, calendar.reset_index(drop=True)
+
+
+def merge_holiday_aggregates(left, right):
+    sales = pd.concat([left[0], right[0]], ignore_index=True)
+    sales = sales.groupby(by=HOLIDAY_SALES_KEYS, as_index=False, observed=True)["sales"].sum()
+    return sales, pd.concat([left[1], right[1]], ignore_index=True).drop_duplicates(ignore_index=True)
+
+
+# Reading the csv files chunk by chunk, keeping only the aggregates and the first row of the data
+def stream_aggregates():
+    partial_sums, cube, holidays, first_row = None, None, None, None
+    for file_name in CSV_FILES:
+        chunks = pd.read_csv(os.path.join(DATA_DIR, file_name), dtype=dtypes, usecols=AGGREGATE_COLUMNS,
+                             chunksize=STREAMING_CHUNK_SIZE)
+        for chunk in chunks:
+            chunk["promoted"] = chunk["onpromotion"] != 0
+            chunk_sums, chunk_cube = sheet_1_partials(chunk), sales_cube(chunk)
+            chunk_holidays = holiday_aggregates(chunk)
+            if first_row is None:
+                partial_sums, cube, holidays, first_row = chunk_sums, chunk_cube, chunk_holidays, chunk.iloc[0]
+            else:
+                partial_sums, cube = merge_partials(partial_sums, chunk_sums), merge_cubes(cube, chunk_cube)
+                holidays = merge_holiday_aggregates(holidays, chunk_holidays)
+    return partial_sums, cube, holidays, first_row
+
+
+# Sheet 1 partials, the cube and the holiday aggregates do not depend on each other, so they are computed
+# side by side
+def compute_aggregates(frame):
+    if frame is None:
+        return stream_aggregates()
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        partial_sums_future = executor.submit(sheet_1_partials, frame)
+        holidays_future = executor.submit(holiday_aggregates, frame)
+        cube = sales_cube(frame)
+        return partial_sums_future.result(), cube, holidays_future.result(), frame.iloc[0]
+
+# Delta files merged so far, and the size and mtime of the ones that could not be read, which are tried again
+# once they change (e.g. when they were still being copied)
+applied_deltas = set()
+failed_deltas = {}
+data_version = 0
+delta_lock = threading.Lock()
+
+# Largest n rows of an aggregated table, plus one "Other" row with the sum of the rest
+def top_n(frame, names, values, n=PIE_TOP_N):
+    if not n or len(frame) <= n:
+        return frame
+    frame = frame.sort_values(by=values, ascending=False)
+    other = pd.DataFrame({names: ["Other"], values: [frame[values].iloc[n:].sum()]})
+    return pd.concat([frame[[names, values]].iloc[:n].astype({names: object}), other], ignore_index=True)
+
+
+# Consecutive rows of a table sorted by x are merged into at most max_points buckets, each column aggregated as given
+def downsample(frame, x, aggregations, max_points=MAX_LINE_POINTS):
+    if not max_points or len(frame) <= max_points:
+        return frame
+    buckets = np.arange(len(frame)) * max_points // len(frame)
+    return frame.groupby(buckets).agg({x: "first", **aggregations}).reset_index(drop=True)
+
+
 # Figure of average sales per week day
-dataframe_week_days = dataframe.groupby(by="day_of_week", as_index=False)["sales"].mean()
-dataframe_week_days.rename(columns={"sales": "avg_sales"}, inplace=True)
-fig = px.pie(dataframe_week_days,
-             names="day_of_week",
-             values="avg_sales",
-             width=354,
-             height=350,
-             template="ggplot2")
-
-piechart_days = html.Div(
-    children=[
-        html.H4(
-            children='Average sales per day of the week',
-            className='figure-text',
-        ),
-        dcc.Graph(
-            id='piechart-days',
-            figure=fig
-        )
-    ],
-    className="figure"
-)
+def figure_week_days(tables):
+    fig = px.pie(tables["week_days"],
+                 names="day_of_week",
+                 values="avg_sales",
+                 width=354,
+                 height=350,
+                 template="ggplot2")
+    return fig
+
 
 # Figure of average sales per week
-dataframe_weeks_year = dataframe.groupby(by=["week", "year"], as_index=False)["sales"].sum()
-dataframe_weeks = dataframe_weeks_year.groupby(by="week", as_index=False)["sales"].mean()
-dataframe_weeks.rename(columns={"sales": "avg_sales"}, inplace=True)
-dataframe_weeks["max_sales"] = dataframe_weeks_year.groupby(by="week")["sales"].max()
-dataframe_weeks.sort_values(by="week", ascending=True, inplace=True)
-fig = px.line(dataframe_weeks,
-              x="week",
-              y=["avg_sales", "max_sales"],
-              width=1024,
-              height=350,
-              template="ggplot2")
-
-fig.add_shape(
-    type="line",
-    line_color="salmon",
-    line_width=3,
-    opacity=1,
-    line_dash="dot",
-    xref="paper",
-    x0=0,
-    x1=1,
-    y0=dataframe_weeks['avg_sales'].mean(),
-    y1=dataframe_weeks['avg_sales'].mean(),
-    yref="y"
-)
+def figure_weeks(tables):
+    dataframe_weeks = tables["weeks"]
+    fig = px.line(downsample(dataframe_weeks, "week", {"avg_sales": "mean", "max_sales": "max"}),
+                  x="week",
+                  y=["avg_sales", "max_sales"],
+                  width=1024,
+                  height=350,
+                  template="ggplot2")
+
+    fig.add_shape(
+        type="line",
+        line_color="salmon",
+        line_width=3,
+        opacity=1,
+        line_dash="dot",
+        xref="paper",
+        x0=0,
+        x1=1,
+        y0=dataframe_weeks['avg_sales'].mean(),
+        y1=dataframe_weeks['avg_sales'].mean(),
+        yref="y"
+    )
+    return fig
 
-linechart_weeks = html.Div(
-    children=[
-        html.H4(
-            children='Average sales per week',
-            className='figure-text',
-        ),
-        dcc.Graph(
-            id='linechart-weeks',
-            figure=fig
-        )
-    ],
-    className="figure"
-)
 
 # Figure of average sales per month
-dataframe_months_year = dataframe.groupby(by=["month", "year"], as_index=False)["sales"].sum()
-dataframe_months = dataframe_months_year.groupby(by="month", as_index=False)["sales"].mean()
-dataframe_months.rename(columns={"sales": "avg_sales"}, inplace=True)
-dataframe_months["max_sales"] = dataframe_months_year.groupby(by="month")["sales"].max()
-dataframe_months.sort_values(by="month", ascending=True, ignore_index=True, inplace=True)
-fig = px.line(dataframe_months,
-              x="month",
-              y=["avg_sales", "max_sales"],
-              width=670,
-              height=350,
-              template="ggplot2")
-
-fig.add_shape(
-    type="line",
-    line_color="salmon",
-    line_width=3,
-    opacity=1,
-    line_dash="dot",
-    xref="paper",
-    x0=0,
-    x1=1,
-    y0=dataframe_months['avg_sales'].mean(),
-    y1=dataframe_months['avg_sales'].mean(),
-    yref="y"
-)
+def figure_months(tables):
+    dataframe_months = tables["months"]
+    fig = px.line(downsample(dataframe_months, "month", {"avg_sales": "mean", "max_sales": "max"}),
+                  x="month",
+                  y=["avg_sales", "max_sales"],
+                  width=670,
+                  height=350,
+                  template="ggplot2")
+
+    fig.add_shape(
+        type="line",
+        line_color="salmon",
+        line_width=3,
+        opacity=1,
+        line_dash="dot",
+        xref="paper",
+        x0=0,
+        x1=1,
+        y0=dataframe_months['avg_sales'].mean(),
+        y1=dataframe_months['avg_sales'].mean(),
+        yref="y"
+    )
+    return fig
 
-linechart_months = html.Div(
-    children=[
-        html.H4(
-            children='Average sales per month',
-            className='figure-text',
-        ),
-        dcc.Graph(
-            id='linechart-months',
-            figure=fig
-        )
-    ],
-    className="figure"
-)
 
 # Top ten most sold product families
-dataframe_products = dataframe.groupby(by=["family"], as_index=False)["sales"].sum()
-dataframe_products.sort_values(by="sales", ascending=True, ignore_index=True, inplace=True)
-
-fig = px.bar(dataframe_products[-10:],
-             x="sales",
-             y="family",
-             color="sales",
-             color_continuous_scale='Viridis',
-             template='ggplot2',
-             orientation='h',
-             height=600,
-             width=1024)
-
-barchart_products = html.Div(
-    children=[
-        html.H4(
-            children='Top 10 most sold Product Categories',
-            className='figure-text',
-        ),
-        dcc.Graph(
-            id='barchart-products',
-            figure=fig
-        ),
-    ],
-    className="figure"
-)
+def figure_products(tables):
+    fig = px.bar(tables["products"][-10:],
+                 x="sales",
+                 y="family",
+                 color="sales",
+                 color_continuous_scale='Viridis',
+                 template='ggplot2',
+                 orientation='h',
+                 height=600,
+                 width=1024)
+    return fig
 
-dataframe_products.sort_values(by="sales", ascending=False, ignore_index=True, inplace=True)
 
 # Product Categories with the most profit obtained with promotions
-dataframe_prom_bool = dataframe.copy()
-dataframe_prom_bool["onpromotion"] = dataframe_prom_bool["onpromotion"].apply(bool)
-dataframe_prom_prod = dataframe_prom_bool[dataframe_prom_bool["onpromotion"] == True].groupby(by=["family"],
-                                                                                              as_index=False
-                                                                                              )["sales"].sum()
-dataframe_prom_prod.sort_values(by="sales", ascending=True, ignore_index=True, inplace=True)
-
-fig = px.bar(dataframe_prom_prod[-10:],
-             x="sales",
-             y="family",
-             color="sales",
-             color_continuous_scale='Magma',
-             template='ggplot2',
-             orientation='h',
-             height=600,
-             width=1024)
-
-barchart_prom = html.Div(
-    children=[
-        html.H4(
-            children='Top 10 Product Categories with the most profit obtained with promotions',
-            className='figure-text',
-        ),
-        dcc.Graph(
-            id='barchart-prom',
-            figure=fig
-        )
-    ],
-    className="figure"
-)
+def figure_prom(tables):
+    fig = px.bar(tables["prom_prod"][-10:],
+                 x="sales",
+                 y="family",
+                 color="sales",
+                 color_continuous_scale='Magma',
+                 template='ggplot2',
+                 orientation='h',
+                 height=600,
+                 width=1024)
+    return fig
+
 
 # Figure of sales per store type
-dataframe_store_types = dataframe.groupby(by="store_type", as_index=False)["sales"].sum()
-fig = px.pie(dataframe_store_types,
-             names="store_type",
-             values="sales",
-             width=1024,
-             height=600,
-             template="ggplot2")
-
-piechart_stores = html.Div(
-    children=[
-        html.H4(
-            children='Where does the most profit come from? (Store types)',
-            className='figure-text',
-        ),
-        dcc.Graph(
-            id='piechart-stores',
-            figure=fig
-        )
-    ],
-    className="figure"
-)
+def figure_store_types(tables):
+    fig = px.pie(tables["store_types"],
+                 names="store_type",
+                 values="sales",
+                 width=1024,
+                 height=600,
+                 template="ggplot2")
+    return fig
+
+
+# Figures of sheet 1 in the order they are shown: graph id, title and figure builder
+SHEET_1_FIGURES = [
+    ("piechart-days", 'Average sales per day of the week', figure_week_days),
+    ("linechart-months", 'Average sales per month', figure_months),
+    ("linechart-weeks", 'Average sales per week', figure_weeks),
+    ("barchart-products", 'Top 10 most sold Product Categories', figure_products),
+    ("barchart-prom", 'Top 10 Product Categories with the most profit obtained with promotions', figure_prom),
+    ("piechart-stores", 'Where does the most profit come from? (Store types)', figure_store_types),
+]
+
+
+def figure_div(graph_id, title, fig):
+    return html.Div(
+        children=[
+            html.H4(
+                children=title,
+                className='figure-text',
+            ),
+            dcc.Graph(
+                id=graph_id,
+                figure=fig
+            )
+        ],
+        className="figure"
+    )
+
 
 # APP
 app = Dash(__name__,
            suppress_callback_exceptions=True,
            external_stylesheets=external_stylesheets)
 app.title = "Godelicious: Delicacies in one GO!"
+server = app.server
+
+# Dash serializes the callback responses with the JSON engine of plotly, which orjson makes several times faster
+# (numpy arrays included)
+if orjson is not None:
+    pio.json.config.default_engine = "orjson"
+
+
+# Secondary filter of a tab: a multiple choice dropdown where no selection means all values
+def filter_dropdown(title, dropdown_id, values, placeholder):
+    return html.Div(
+        children=[
+            html.Div(children=title, className="menu-title"),
+            dcc.Dropdown(
+                id=dropdown_id,
+                options=[
+                    {"label": value, "value": value}
+                    for value in values
+                ],
+                value=[],
+                multi=True,
+                placeholder=placeholder,
+                className="dropdown",
+            ),
+        ],
+        className="menu-filter"
+    )
+
+
+# Data of the traces of the figures of a sheet sent by the server or, when the sheet is drawn in the browser,
+# the selection it asks the server for and the answer of the server
+def sheet_stores(prefix):
+    if not CLIENTSIDE_CALLBACKS:
+        return [dcc.Store(id=prefix + "-traces")]
+    return [dcc.Store(id=prefix + "-request"), dcc.Store(id=prefix + "-results")]
+
 
 # Tabs content
-tab_1 = html.Div(
-    children=[
-        html.Div(
-            children=[
-                dbc.Row(
-                    children=[
-                        dbc.Col(
-                            dbc.Card(
-                                children=[
-                                    dbc.CardHeader("Number of store-clients collected"),
-                                    dbc.CardBody(
-                                        [
-                                            html.H5("Store-clients", className="card-title"),
-                                            html.P(
-                                                str(dataframe['store_nbr'].nunique()) + " stores",
-
-                                            ),
-                                        ],
-                                    ),
+def make_tab_1():
+    return html.Div(
+        children=[
+            html.Div(
+                children=[
+                    dbc.Row(
+                        children=[
+                            dbc.Col(
+                                dbc.Card(
+                                    children=[
+                                        dbc.CardHeader("Number of store-clients collected"),
+                                        dbc.CardBody(
+                                            [
+                                                html.H5("Store-clients", className="card-title"),
+                                                html.P(
+                                                    str(sheet_1["counts"]["stores"]) + " stores",
+                                                    id="count-stores",
+
+                                                ),
+                                            ],
+                                        ),
+                                    ],
+                                    color="primary",
+                                    outline=True
+                                ),
+                            ),
+                            dbc.Col(
+                                dbc.Card(
+                                    children=[
+                                        dbc.CardHeader("Number of product categories sold"),
+                                        dbc.CardBody(
+                                            [
+                                                html.H5("Product categories", className="card-title"),
+                                                html.P(
+                                                    str(sheet_1["counts"]["families"]) + " categories",
+                                                    id="count-families",
+
+                                                ),
+                                            ],
+                                        ),
+                                    ],
+                                    color="secondary",
+                                    outline=True
+                                ),
+                            ),
+                            dbc.Col(
+                                dbc.Card(
+                                    children=[
+                                        dbc.CardHeader("Number of years of collected data"),
+                                        dbc.CardBody(
+                                            [
+                                                html.H5("Years", className="card-title"),
+                                                html.P(
+                                                    str(sheet_1["counts"]["years"]) + " years",
+                                                    id="count-years",
+
+                                                ),
+                                            ],
+                                        ),
+                                    ],
+                                    color="warning",
+                                    outline=True
+                                ),
+                            ),
+                        ],
+                        className="mb-4",
+                    ),
+                    dbc.Row(
+                        children=[
+                            dbc.Col(
+                                dbc.Card(
+                                    children=[
+                                        dbc.CardHeader("Number of states where the company is active"),
+                                        dbc.CardBody(
+                                            [
+                                                html.H5("States", className="card-title"),
+                                                html.P(
+                                                    str(sheet_1["counts"]["states"]) + " states",
+                                                    id="count-states",
+
+                                                ),
+                                            ],
+                                        ),
+                                    ],
+                                    color="warning",
+                                    outline=True
+                                ),
+                            ),
+                            dbc.Col(
+                                dbc.Card(
+                                    children=[
+                                        dbc.CardHeader("Number of cities where the company is active"),
+                                        dbc.CardBody(
+                                            [
+                                                html.H5("Cities", className="card-title"),
+                                                html.P(
+                                                    str(sheet_1["counts"]["cities"]) + " cities",
+                                                    id="count-cities",
+
+                                                ),
+                                            ],
+                                        ),
+                                    ],
+                                    color="success",
+                                    outline=True
+                                ),
+                            ),
+                            dbc.Col(
+                                dbc.Card(
+                                    children=[
+                                        dbc.CardHeader("Number of months of collected data"),
+                                        dbc.CardBody(
+                                            [
+                                                html.H5("Months", className="card-title"),
+                                                html.P(
+                                                    str(sheet_1["counts"]["months"]) + " months",
+                                                    id="count-months",
+
+                                                ),
+                                            ],
+                                        ),
+                                    ],
+                                    color="danger",
+                                    outline=True
+                                ),
+                            ),
+                        ],
+                        className="mb-4",
+                    ),
+                ],
+                className="card-box"
+            ),
+            html.Div(id="sheet-1-status", className="status"),
+            html.Div(
+                children=[
+                    figure_div(graph_id, title, sheet_1_figures[graph_id])
+                    for graph_id, title, _ in SHEET_1_FIGURES
+                ],
+                className="figure-box"
+            ),
+        ]
+    )
+
+
+def make_tab_2():
+    return html.Div(
+        children=[
+            html.Div(
+                children=[
+                    html.Div(
+                        children=[
+                            html.Div(children="Store:", className="menu-title"),
+                            dcc.Dropdown(
+                                id="store-filter",
+                                options=[
+                                    {"label": store_nbr, "value": store_nbr}
+                                    for store_nbr in dimensions["store_nbr"]
                                 ],
-                                color="primary",
-                                outline=True
+                                value=[1],
+                                multi=True,
+                                clearable=False,
+                                placeholder="All stores",
+                                className="dropdown",
                             ),
-                        ),
-                        dbc.Col(
-                            dbc.Card(
+                        ],
+                        className="menu"
+                    ),
+                ]
+            ),
+            html.Div(
+                children=[
+                    filter_dropdown("In states:", "store-state-filter", dimensions["state"], "All states"),
+                    filter_dropdown("Years:", "store-year-filter", dimensions["year"], "All years"),
+                ],
+                className="menu menu-secondary"
+            ),
+            html.Div(
+                children=[
+                    html.Div(
+                        id="store-cards",
+                        className="card-box",
+                    ),
+                    html.Div(id="store-status", className="status"),
+                    *sheet_stores("store"),
+                    html.Div(
+                        children=[
+                            html.Div(
                                 children=[
-                                    dbc.CardHeader("Number of product categories sold"),
-                                    dbc.CardBody(
-                                        [
-                                            html.H5("Product categories", className="card-title"),
-                                            html.P(
-                                                str(dataframe['family'].nunique()) + " categories",
-
-                                            ),
-                                        ],
+                                    html.H4(
+                                        children='Top 10 most sold Product Categories',
+                                        className="figure-text",
+                                    ),
+                                    dcc.Graph(
+                                        id="barchart-store-sales",
+                                        figure=figure_template("barchart-store-sales"),
                                     ),
                                 ],
-                                color="secondary",
-                                outline=True
+                                className="figure"
                             ),
-                        ),
-                        dbc.Col(
-                            dbc.Card(
+                            html.Div(
                                 children=[
-                                    dbc.CardHeader("Number of years of collected data"),
-                                    dbc.CardBody(
-                                        [
-                                            html.H5("Years", className="card-title"),
-                                            html.P(
-                                                str(dataframe['year'].nunique()) + " years",
-
-                                            ),
-                                        ],
+                                    html.H4(
+                                        children='What are the most sold product categories?',
+                                        className="figure-text",
+                                    ),
+                                    dcc.Graph(
+                                        id="piechart-store-products",
+                                        figure=figure_template("piechart-store-products"),
                                     ),
                                 ],
-                                color="warning",
-                                outline=True
+                                className="figure"
                             ),
-                        ),
-                    ],
-                    className="mb-4",
-                ),
-                dbc.Row(
-                    children=[
-                        dbc.Col(
-                            dbc.Card(
-                                children=[
-                                    dbc.CardHeader("Number of states where the company is active"),
-                                    dbc.CardBody(
-                                        [
-                                            html.H5("States", className="card-title"),
-                                            html.P(
-                                                str(dataframe['state'].nunique()) + " states",
-
-                                            ),
-                                        ],
-                                    ),
+                        ],
+                        className="figure-box"
+                    ),
+                ],
+            ),
+        ],
+    )
+
+
+def make_tab_3():
+    return html.Div(
+        children=[
+            html.Div(
+                children=[
+                    html.Div(
+                        children=[
+                            html.Div(children="State:", className="menu-title"),
+                            dcc.Dropdown(
+                                id="state-filter",
+                                options=[
+                                    {"label": state, "value": state}
+                                    for state in dimensions["state"]
                                 ],
-                                color="warning",
-                                outline=True
+                                value=[first_row["state"]],
+                                multi=True,
+                                clearable=False,
+                                placeholder="All states",
+                                className="dropdown",
                             ),
-                        ),
-                        dbc.Col(
-                            dbc.Card(
+                        ],
+                        className="menu"
+                    ),
+                ]
+            ),
+            html.Div(
+                children=[
+                    filter_dropdown("Products:", "state-family-filter", dimensions["family"], "All products"),
+                    filter_dropdown("Years:", "state-year-filter", dimensions["year"], "All years"),
+                ],
+                className="menu menu-secondary"
+            ),
+            html.Div(
+                children=[
+                    html.Div(
+                        id="state-cards",
+                        className="card-box"
+                    ),
+                    html.Div(id="state-status", className="status"),
+                    *sheet_stores("state"),
+                    html.Div(
+                        children=[
+                            html.Div(
                                 children=[
-                                    dbc.CardHeader("Number of cities where the company is active"),
-                                    dbc.CardBody(
-                                        [
-                                            html.H5("Cities", className="card-title"),
-                                            html.P(
-                                                str(dataframe['city'].nunique()) + " cities",
-
-                                            ),
-                                        ],
+                                    html.H4(
+                                        children="Most profitable shops in region",
+                                        className="figure-text",
+                                    ),
+                                    dcc.Graph(
+                                        id="barchart-state-sales",
+                                        figure=figure_template("barchart-state-sales"),
                                     ),
                                 ],
-                                color="success",
-                                outline=True
+                                className="figure"
                             ),
-                        ),
-                        dbc.Col(
-                            dbc.Card(
-                                children=[
-                                    dbc.CardHeader("Number of months of collected data"),
-                                    dbc.CardBody(
-                                        [
-                                            html.H5("Months", className="card-title"),
-                                            html.P(
-                                                str(len(dataframe.groupby(by=["month", "year"]))) + " months",
-
-                                            ),
-                                        ],
-                                    ),
+                        ],
+                        className="figure-box"
+                    ),
+                ],
+            ),
+        ],
+    )
+
+
+def make_tab_4():
+    return html.Div(
+        children=[
+            html.Div(
+                children=[
+                    html.Div(
+                        children=[
+                            html.Div(children="Product:", className="menu-title"),
+                            dcc.Dropdown(
+                                id="product-filter",
+                                options=[
+                                    {"label": stype, "value": stype}
+                                    for stype in dimensions["family"]
                                 ],
-                                color="danger",
-                                outline=True
+                                value=[first_row["family"]],
+                                multi=True,
+                                clearable=False,
+                                placeholder="All product categories",
+                                className="dropdown",
                             ),
-                        ),
-                    ],
-                    className="mb-4",
-                ),
-            ],
-            className="card-box"
-        ),
-        html.Div(
-            children=[
-                piechart_days,
-                linechart_months,
-                linechart_weeks,
-                barchart_products,
-                barchart_prom,
-                piechart_stores,
-            ],
-            className="figure-box"
-        ),
-    ]
-)
+                        ],
+                        className="menu"
+                    ),
+                ],
+            ),
+            html.Div(
+                children=[
+                    filter_dropdown("In states:", "product-state-filter", dimensions["state"], "All states"),
+                    filter_dropdown("Years:", "product-year-filter", dimensions["year"], "All years"),
+                ],
+                className="menu menu-secondary"
+            ),
+            html.Div(
+                children=[
+                    html.Div(
+                        id="product-cards",
+                        className="card-box"
+                    ),
+                    html.Div(id="product-status", className="status"),
+                    *sheet_stores("product"),
+                    html.Div(
+                        children=[
+                            html.Div(
+                                children=[
+                                    html.H4(
+                                        children="Top 10 cities where the product was most successful",
+                                        className="figure-text",
+                                    ),
+                                    dcc.Graph(
+                                        id="barchart-product-city",
+                                        figure=figure_template("barchart-product-city"),
+                                    ),
+                                ],
+                                className="figure"
+                            ),
+                        ],
+                        className="figure-box"
+                    ),
+                ],
+            ),
+        ],
+    )
 
-tab_2 = html.Div(
-    children=[
-        html.Div(
-            children=[
-                html.Div(
-                    children=[
-                        html.Div(children="Store:", className="menu-title"),
-                        dcc.Dropdown(
-                            id="store-filter",
-                            options=[
-                                {"label": store_nbr, "value": store_nbr}
-                                for store_nbr in np.sort(dataframe["store_nbr"].unique())
-                            ],
-                            value=1,
-                            clearable=False,
-                            className="dropdown",
-                        ),
-                    ],
-                    className="menu"
-                ),
-            ]
-        ),
-        html.Div(
-            children=[
-                html.Div(
-                    id="store-cards",
-                    className="card-box",
-                ),
-                html.Div(
-                    children=[
-                        html.Div(
-                            children=[
-                                html.H4(
-                                    children='Top 10 most sold Product Categories',
-                                    className="figure-text",
-                                ),
-                                dcc.Graph(
-                                    id="barchart-store-sales",
-                                ),
-                            ],
-                            className="figure"
-                        ),
-                        html.Div(
-                            children=[
-                                html.H4(
-                                    children='What are the most sold product categories?',
-                                    className="figure-text",
-                                ),
-                                dcc.Graph(
-                                    id="piechart-store-products",
-                                ),
-                            ],
-                            className="figure"
-                        ),
-                    ],
-                    className="figure-box"
-                ),
-            ],
-        ),
-    ],
-)
 
-tab_3 = html.Div(
-    children=[
-        html.Div(
-            children=[
-                html.Div(
-                    children=[
-                        html.Div(children="State:", className="menu-title"),
-                        dcc.Dropdown(
-                            id="state-filter",
-                            options=[
-                                {"label": state, "value": state}
-                                for state in np.sort(dataframe["state"].unique())
-                            ],
-                            value=dataframe.iloc[0]["state"],
-                            clearable=False,
-                            className="dropdown",
-                        ),
-                    ],
-                    className="menu"
-                ),
-            ]
-        ),
-        html.Div(
+def make_tab_5():
+    return html.Div(
+        children=[
+            html.Div(
+                children=[
+                    filter_dropdown("Stores:", "holiday-store-filter", dimensions["store_nbr"], "All stores"),
+                    filter_dropdown("Product categories:", "holiday-family-filter", dimensions["family"],
+                                    "All categories"),
+                ],
+                className="menu"
+            ),
+            html.Div(
+                children=[
+                    html.Div(
+                        id="holiday-cards",
+                        className="card-box"
+                    ),
+                    html.Div(id="holiday-status", className="status"),
+                    dcc.Store(id="holiday-traces"),
+                    html.Div(
+                        children=[
+                            figure_div(graph_id, title, figure_template(graph_id))
+                            for graph_id, title in zip(sheet_graphs("holiday"), [
+                                "Sales uplift per holiday type, with and without transfer",
+                                "Sales uplift per holiday locale, with and without transfer",
+                                "Sales uplift on holidays per store",
+                            ])
+                        ],
+                        className="figure-box"
+                    ),
+                ],
+            ),
+        ],
+    )
+
+
+# Bounds and marks of the date range slider: one step per month and a mark at the start of every year
+def date_range_slider():
+    first, last = date_range
+    return {"min": first,
+            "max": last,
+            "marks": {period: str(period // 12) for period in range(first, last + 1)
+                      if period % 12 == 0 or period == first}}
+
+
+def period_label(period):
+    return "%s %d" % (calendar.month_abbr[period % 12 + 1], period // 12)
+
+
+# The layout is built for every page load, so that the date range slider always covers the data loaded so far
+def serve_layout():
+    return html.Div([
+        dcc.Tabs(
+            id="tabs-styled-with-inline",
             children=[
-                html.Div(
-                    id="state-cards",
-                    className="card-box"
-                ),
-                html.Div(
-                    children=[
-                        html.Div(
-                            children=[
-                                html.H4(
-                                    children="Most profitable shops in region",
-                                    className="figure-text",
-                                ),
-                                dcc.Graph(
-                                    id="barchart-state-sales",
-                                ),
-                            ],
-                            className="figure"
-                        ),
-                    ],
-                    className="figure-box"
-                ),
+                dcc.Tab(label='Sheet 1', value='sheet-1', className="tab", selected_className="custom-tab"),
+                dcc.Tab(label='Sheet 2', value='sheet-2', className="tab", selected_className="custom-tab"),
+                dcc.Tab(label='Sheet 3', value='sheet-3', className="tab", selected_className="custom-tab"),
+                dcc.Tab(label='Sheet 4', value='sheet-4', className="tab", selected_className="custom-tab"),
+                dcc.Tab(label='Sheet 5', value='sheet-5', className="tab", selected_className="custom-tab"),
             ],
+            value='sheet-1',
+            parent_className='custom-tabs',
         ),
-    ],
-)
-
-tab_4 = html.Div(
-    children=[
         html.Div(
             children=[
                 html.Div(
                     children=[
-                        html.Div(children="State:", className="menu-title"),
-                        dcc.Dropdown(
-                            id="product-filter",
-                            options=[
-                                {"label": stype, "value": stype}
-                                for stype in np.sort(dataframe["family"].unique())
-                            ],
-                            value=dataframe.iloc[0]["family"],
-                            clearable=False,
-                            className="dropdown",
+                        html.P(children="📊", className="header-emoji"),
+                        html.H1(
+                            children="Godelicious Dashboard", className="header-title"
+                        ),
+                        html.P(
+                            children="Analyze and visualize the main Godelicious KPIs in a"
+                                     " dashboard made with Dash.",
+                            className="header-description",
                         ),
                     ],
-                    className="menu"
+                    className="header",
                 ),
             ],
         ),
         html.Div(
             children=[
-                html.Div(
-                    id="product-cards",
-                    className="card-box"
-                ),
+                html.Div(children="Months:", className="menu-title"),
                 html.Div(
                     children=[
-html.Div(
-                            children=[
-                                html.H4(
-                                    children="Top 10 cities where the product was most successful",
-                                    className="figure-text",
-                                ),
-                                dcc.Graph(
-                                    id="barchart-product-city",
-                                ),
-                            ],
-                            className="figure"
+                        dcc.RangeSlider(
+                            id="date-range",
+                            step=1,
+                            value=list(date_range),
+                            allowCross=False,
+                            **date_range_slider()
                         ),
+                        html.Div(id="date-range-label", className="date-range-label"),
                     ],
-                    className="figure-box"
+                    className="date-range-slider"
                 ),
             ],
+            className="menu date-range"
         ),
+        html.Div(id='tabs-content-inline'),
+        dcc.Store(id='data-version', data=data_version),
+        *([dcc.Store(id='clientside-data')] if CLIENTSIDE_CALLBACKS else []),
+        dcc.Interval(id='delta-interval', interval=DELTA_INTERVAL * 1000, disabled=DELTA_DIR is None),
     ],
-)
+    )
 
-app.layout = html.Div([
-    dcc.Tabs(
-        id="tabs-styled-with-inline",
-        children=[
-            dcc.Tab(label='Sheet 1', value='sheet-1', className="tab", selected_className="custom-tab"),
-            dcc.Tab(label='Sheet 2', value='sheet-2', className="tab", selected_className="custom-tab"),
-            dcc.Tab(label='Sheet 3', value='sheet-3', className="tab", selected_className="custom-tab"),
-            dcc.Tab(label='Sheet 4', value='sheet-4', className="tab", selected_className="custom-tab"),
-        ],
-        value='sheet-1',
-        parent_className='custom-tabs',
-    ),
-    html.Div(
-        children=[
-            html.Div(
-                children=[
-                    html.P(children="📊", className="header-emoji"),
-                    html.H1(
-                        children="Godelicious Dashboard", className="header-title"
-                    ),
-                    html.P(
-                        children="Analyze and visualize the main Godelicious KPIs in a"
-                                 " dashboard made with Dash.",
-                        className="header-description",
-                    ),
-                ],
-                className="header",
-            ),
-        ],
-    ),
-    html.Div(id='tabs-content-inline')
-],
-)
 
+app.layout = serve_layout
 
-# Sheet 2 I/O
-@app.callback(
-    [Output("store-cards", "children"),
-     Output("barchart-store-sales", "figure"),
-     Output("piechart-store-products", "figure")],
-    Input("store-filter", "value")
-)
-def update_charts_sheet_2(store):
-    mask = dataframe_prom_bool[dataframe_prom_bool["store_nbr"] == store]
-    mask_sales_year = mask.groupby(by=["year", "onpromotion"], as_index=False)["sales"].sum()
 
-    cards = dbc.Row(
-        children=[
-            dbc.Col(
-                dbc.Card(
-                    children=[
-                        dbc.CardHeader("Total number of sold product categories"),
-                        dbc.CardBody(
-                            [
-                                html.H5("Product categories", className="card-title"),
-                                html.P(
-                                    str(mask[mask["sales"] != 0]["family"].nunique()) + " products",
+# Manager of the background callbacks, or None to run the callbacks in the server threads
+background_cache, background_manager = None, None
+if BACKGROUND_CALLBACKS:
+    try:
+        background_cache = diskcache.Cache(BACKGROUND_CACHE_DIR)
+        background_manager = DiskcacheManager(background_cache, cache_by=[lambda: data_version],
+                                              expire=BACKGROUND_EXPIRE)
+    except (AttributeError, ImportError) as error:
+        logger.warning("background callbacks are disabled: %s", error)
+        background_cache = None
 
-                                ),
-                            ]
-                        )
-                    ],
-                    color=random.choice(["warning", "secondary", "primary", "success", "danger"]),
-                    outline=True
-                )
-            ),
-            dbc.Col(
-                dbc.Card(
-                    children=[
-                        dbc.CardHeader("Total number of sales made"),
-                        dbc.CardBody(
-                            [
-                                html.H5("Sales", className="card-title"),
-                                html.P(
-                                    str(mask['sales'].sum()) + " sales",
 
-                                ),
-                            ]
-                        )
-                    ],
-                    color=random.choice(["warning", "secondary", "primary", "success", "danger"]),
-                    outline=True
-                )
-            ),
+# Options of a callback that runs in the background when enabled, showing that it is running in an element
+def background_options(status_id):
+    if background_manager is None:
+        return {}
+    return {"background": True,
+            "manager": background_manager,
+            "running": [(Output(status_id, "children"), "Updating...", "")]}
+
+
+# Computations running in this process by function, data version and arguments, and number of calls that
+# waited for one of them instead of computing the same results again
+in_flight = {}
+in_flight_lock = threading.Lock()
+coalesced_calls = {}
+
+
+# Single flight: concurrent calls with the same arguments share the computation of the first one. The version of
+# the data is the first argument, so a call never joins a computation of an older version of the data, and results
+# are not kept once they are computed
+def single_flight(compute, *args):
+    key = (compute.__name__, args)
+    with in_flight_lock:
+        future = in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = in_flight[key] = concurrent.futures.Future()
+        else:
+            coalesced_calls[compute.__name__] = coalesced_calls.get(compute.__name__, 0) + 1
+    if not leader:
+        return future.result()
+    try:
+        future.set_result(compute(*args))
+    except BaseException as error:
+        future.set_exception(error)
+    finally:
+        with in_flight_lock:
+            del in_flight[key]
+    return future.result()
+
+
+UNCOMPUTED = object()
+
+
+# Results of a sheet for a selection, shared by concurrent calls of this process, and by the worker processes
+# through the background cache when enabled. The first process to ask for a selection computes it under a lock,
+# which the others wait for before reading its results
+def shared_results(compute, *args):
+    if background_cache is None:
+        return single_flight(compute, *args)
+    # The report is loaded before the lock is taken, so that nothing under the lock, which other processes wait
+    # for, can wait on the state of this process
+    ensure_report()
+    key = "%s-%r" % (compute.__name__, args)
+    results = background_cache.get(key, default=UNCOMPUTED)
+    if results is UNCOMPUTED:
+        with diskcache.Lock(background_cache, "lock-" + key, expire=BACKGROUND_EXPIRE):
+            results = background_cache.get(key, default=UNCOMPUTED)
+            if results is UNCOMPUTED:
+                results = compute(*args)
+                background_cache.set(key, results, expire=BACKGROUND_EXPIRE)
+    return results
+
+
+# Cards of the callbacks, given as (header, title, text) tuples
+CARD_COLORS = ["warning", "secondary", "primary", "success", "danger"]
+
+
+def make_cards(cards):
+    return dbc.Row(
+        children=[
             dbc.Col(
                 dbc.Card(
                     children=[
-                        dbc.CardHeader("Store type of the selected store"),
+                        dbc.CardHeader(header),
                         dbc.CardBody(
                             [
-                                html.H5("Type", className="card-title"),
+                                html.H5(title, className="card-title"),
                                 html.P(
-                                    mask.iloc[0]["store_type"] + " type",
-
+                                    text,
                                 ),
                             ]
                         )
                     ],
-                    color=random.choice(["warning", "secondary", "primary", "success", "danger"]),
+                    color=random.choice(CARD_COLORS),
                     outline=True
                 )
-            ),
+            )
+            for header, title, text in cards
         ]
     )
 
-    figure_1 = px.bar(mask_sales_year,
-                      x="year",
-                      y="sales",
-                      color="onpromotion",
-                      template='ggplot2',
-                      orientation='v',
-                      height=600,
-                      width=1024)
-
-    figure_2 = px.pie(mask[mask["sales"] != 0],
-                      names="family",
-                      values="sales",
-                      template='ggplot2',
-                      height=600,
-                      width=1024)
-    figure_2.update_traces(textposition='inside')
-    figure_2.update_layout(uniformtext_minsize=15, uniformtext_mode='hide')
-    return cards, figure_1, figure_2
+
+# Figures are cached already serialized, so that a repeated selection only has to send them
+def figure_json(figure):
+    with traced("serialization"):
+        return json.loads(figure.to_json())
+
+
+# Sheet 1 I/O
+# Values of the cards of sheet 1 with their units, shown in the elements "count-<key>"
+SHEET_1_COUNTS = [("stores", "stores"), ("families", "categories"), ("years", "years"),
+                  ("states", "states"), ("cities", "cities"), ("months", "months")]
+
+
+@functools.lru_cache(maxsize=CALLBACK_CACHE_SIZE)
+def sheet_1_results(version, period_range):
+    ensure_report()
+    with traced("groupby"):
+        tables = sheet_1_tables(partial_sums, period_range)
+    with traced("figures"):
+        figures = [build_figure(tables) for _, _, build_figure in SHEET_1_FIGURES]
+    counts = [str(tables["counts"][key]) + " " + unit for key, unit in SHEET_1_COUNTS]
+    return counts, [figure_json(figure) for figure in figures]
 
 
-# Sheet 3 I/O
 @app.callback(
-    [Output("state-cards", "children"),
-     Output("barchart-state-sales", "figure")],
-    Input("state-filter", "value")
+    [Output("count-" + key, "children") for key, _ in SHEET_1_COUNTS] +
+    [Output(graph_id, "figure") for graph_id, _, _ in SHEET_1_FIGURES],
+    Input("date-range", "value"),
+    **background_options("sheet-1-status")
 )
-def update_charts_sheet_3(state):
-    mask = dataframe[dataframe["state"] == state]
+@instrumented
+def update_charts_sheet_1(months):
+    period_range = selected_periods(months)
+    if period_range is not None:
+        counts, figures = shared_results(sheet_1_results, data_version, period_range)
+        return counts + figures
+    # The tab is built with the figures of all the data, so they are only sent when the slider is moved back
+    if ctx.triggered_id != "date-range":
+        return [no_update] * (len(SHEET_1_COUNTS) + len(SHEET_1_FIGURES))
+    return ([str(sheet_1["counts"][key]) + " " + unit for key, unit in SHEET_1_COUNTS] +
+            [sheet_1_figures[graph_id] for graph_id, _, _ in SHEET_1_FIGURES])
 
-    mask_categories = mask.groupby(by="family", as_index=False)["sales"].sum()
-    mask_categories.sort_values(by="sales", ascending=False, inplace=True)
 
-    mask_stores = mask.groupby(by="store_nbr", as_index=False)["sales"].sum()
-    mask_stores["store_nbr"] = mask_stores["store_nbr"].apply(str)
-    mask_stores.sort_values(by="sales", ascending=True, inplace=True)
+# Date range I/O: bounds of the slider, which grow with the delta files, and the selected months
+@app.callback(
+    [Output("date-range", "min"),
+     Output("date-range", "max"),
+     Output("date-range", "marks"),
+     Output("date-range", "value")],
+    Input("data-version", "data"),
+    State("date-range", "value"),
+    State("date-range", "min"),
+    State("date-range", "max"),
+    prevent_initial_call=True
+)
+@instrumented
+def update_date_range(version, months, first, last):
+    settings = date_range_slider()
+    # A slider covering all the data it was shown for keeps covering all of it, new months included
+    covered = not months or (first is not None and months[0] <= first and months[1] >= last)
+    value = list(date_range) if covered else no_update
+    return settings["min"], settings["max"], settings["marks"], value
 
-    cards = dbc.Row(
-        children=[
-            dbc.Col(
-                dbc.Card(
-                    children=[
-                        dbc.CardHeader("Most profitable product category in the region"),
-                        dbc.CardBody(
-                            [
-                                html.H5("Best product category", className="card-title"),
-                                html.P(
-                                    str(mask_categories.iloc[0]["family"]),
 
-                                ),
-                            ]
-                        )
-                    ],
-                    color=random.choice(["warning", "secondary", "primary", "success", "danger"]),
-                    outline=True
-                )
-            ),
-            dbc.Col(
-                dbc.Card(
-                    children=[
-                        dbc.CardHeader("Total number of sales made"),
-                        dbc.CardBody(
-                            [
-                                html.H5("Sales", className="card-title"),
-                                html.P(
-                                    str(mask['sales'].sum()) + " sales",
+@app.callback(
+    Output("date-range-label", "children"),
+    Input("date-range", "value")
+)
+@instrumented
+def update_date_range_label(months):
+    first, last = months or date_range
+    return "%s - %s" % (period_label(first), period_label(last))
 
-                                ),
-                            ]
-                        )
-                    ],
-                    color=random.choice(["warning", "secondary", "primary", "success", "danger"]),
-                    outline=True
-                )
-            ),
-            dbc.Col(
-                dbc.Card(
-                    children=[
-                        dbc.CardHeader("Most common type of store in the selected region"),
-                        dbc.CardBody(
-                            [
-                                html.H5("Store type (most common)", className="card-title"),
-                                html.P(
-                                    mask["store_type"].mode() + " type",
 
-                                ),
-                            ]
-                        )
-                    ],
-                    color=random.choice(["warning", "secondary", "primary", "success", "danger"]),
-                    outline=True
-                )
-            ),
-        ]
-    )
+# Server callback of a sheet, left out when the sheet is drawn in the browser
+def sheet_callback(*args, **kwargs):
+    if CLIENTSIDE_CALLBACKS:
+        return lambda callback: callback
+    return app.callback(*args, **kwargs)
 
-    figure_1 = px.bar(mask_stores[-5:],
-                      x="sales",
-                      y="store_nbr",
-                      template='ggplot2',
-                      orientation='h',
-                      height=600,
-                      width=1024)
-    return cards, figure_1
 
+# Figures of sheets 2 to 4. Their layout and template are built by px once per data version, from all the data,
+# and a callback only sends the data of their traces ("<prefix>-traces"), which assets/clientside.js puts into the
+# figures shown, as a partial update would
+def figure_store_sales(sales_year):
+    return px.bar(sales_year,
+                  x="year",
+                  y="sales",
+                  color="promoted",
+                  labels={"promoted": "onpromotion"},
+                  template='ggplot2',
+                  orientation='v',
+                  height=600,
+                  width=1024)
 
-# Sheet 4 I/O
+
+def figure_store_products(products):
+    figure = px.pie(products,
+                    names="family",
+                    values="sales",
+                    template='ggplot2',
+                    height=600,
+                    width=1024)
+    figure.update_traces(textposition='inside')
+    figure.update_layout(uniformtext_minsize=15, uniformtext_mode='hide')
+    return figure
+
+
+def figure_state_stores(stores):
+    return px.bar(stores,
+                  x="sales",
+                  y="store_nbr",
+                  template='ggplot2',
+                  orientation='h',
+                  height=600,
+                  width=1024)
+
+
+def figure_product_cities(cities):
+    figure = px.bar(cities,
+                    x="sales",
+                    y="city",
+                    template='ggplot2',
+                    orientation='h',
+                    height=600,
+                    width=1024)
+    figure.update_traces(marker_color='#73af48')
+    return figure
+
+
+def figure_holiday_uplift(uplift, x):
+    return px.bar(uplift,
+                  x=x,
+                  y="uplift",
+                  color="transferred",
+                  barmode="group",
+                  labels={"uplift": "sales uplift (%)"},
+                  template='ggplot2',
+                  height=600,
+                  width=1024)
+
+
+def figure_holiday_stores(uplift):
+    return px.bar(uplift,
+                  x="store_nbr",
+                  y="uplift",
+                  labels={"uplift": "sales uplift (%)"},
+                  template='ggplot2',
+                  height=600,
+                  width=1024)
+
+
+# Sheet, graph, figure, columns of the data of its traces and column with one trace per value, if any
+SHEET_FIGURES = [
+    ("store", "barchart-store-sales", figure_store_sales, {"x": "year", "y": "sales"}, "promoted"),
+    ("store", "piechart-store-products", figure_store_products, {"labels": "family", "values": "sales"}, None),
+    ("state", "barchart-state-sales", figure_state_stores, {"x": "sales", "y": "store_nbr"}, None),
+    ("product", "barchart-product-city", figure_product_cities, {"x": "sales", "y": "city"}, None),
+    ("holiday", "barchart-holiday-types", functools.partial(figure_holiday_uplift, x="holiday_type"),
+     {"x": "holiday_type", "y": "uplift"}, "transferred"),
+    ("holiday", "barchart-holiday-locales", functools.partial(figure_holiday_uplift, x="locale"),
+     {"x": "locale", "y": "uplift"}, "transferred"),
+    ("holiday", "barchart-holiday-stores", figure_holiday_stores, {"x": "store_nbr", "y": "uplift"}, None),
+]
+
+
+def sheet_graphs(prefix):
+    return [graph_id for sheet, graph_id, _, _, _ in SHEET_FIGURES if sheet == prefix]
+
+
+# Figures of all the data of a sheet, whose layout and template every selection reuses. Every sheet builds its
+# own, so that the templates of one sheet never depend on the data of another
+@functools.lru_cache(maxsize=None)
+def figure_templates(version, prefix):
+    ensure_report()
+    if prefix == "holiday":
+        tables = holiday_tables(())[1]
+    else:
+        cube = filter_rows({})
+        if prefix == "store":
+            tables = sheet_2_tables(cube)[1]
+        elif prefix == "state":
+            tables = sheet_3_tables(cube)[1]
+        else:
+            tables = (sheet_4_totals(cube)[2],)
+    figures = [figure for figure in SHEET_FIGURES if figure[0] == prefix]
+    return {graph_id: figure_json(build_figure(table))
+            for (_, graph_id, build_figure, _, _), table in zip(figures, tables)}
+
+
+def figure_template(graph_id):
+    prefix = next(figure[0] for figure in SHEET_FIGURES if figure[1] == graph_id)
+    return figure_templates(data_version, prefix)[graph_id]
+
+
+# Data of the traces of a figure for a table, in the order of the traces of its template
+def figure_traces(graph_id, table):
+    _, _, _, columns, color = next(figure for figure in SHEET_FIGURES if figure[1] == graph_id)
+    if color is None:
+        tables = [table]
+    else:
+        values = table[color].astype(str)
+        tables = [table[values == trace["name"]] for trace in figure_template(graph_id)["data"]]
+    return [{attribute: rows[column].tolist() for attribute, column in columns.items()} for rows in tables]
+
+
+# Cards and data of the traces of a sheet for a selection without any data, shown instead of leaving those of the
+# previous selection on the screen
+NO_DATA_CARDS = [("No data for this selection", "No data", "Change the filters or the range of months")]
+
+
+def no_data_outputs(prefix):
+    traces = [[{attribute: [] for attribute in columns} for _ in figure_template(graph_id)["data"]]
+              for sheet, graph_id, _, columns, _ in SHEET_FIGURES if sheet == prefix]
+    return make_cards(NO_DATA_CARDS), traces
+
+
+# Figure of a graph with the data of its traces, for the pages that are not updated by the browser
+def patched_figure(graph_id, traces):
+    template = figure_template(graph_id)
+    return dict(template, data=[dict(trace, **update) for trace, update in zip(template["data"], traces)])
+
+
+# Sheet 2 I/O
+# Cards and tables of the figures of some rows of the cube
+def sheet_2_tables(mask):
+    with traced("groupby"):
+        mask_sales_year = mask.groupby(by=["year", "promoted"], as_index=False)["sales"].sum()
+        mask_products = mask[mask["sold_rows"] != 0].groupby(by="family", as_index=False,
+                                                             observed=True)["sales"].sum()
+
+    cards = [
+        ("Total number of sold product categories", "Product categories", str(len(mask_products)) + " products"),
+        ("Total number of sales made", "Sales", str(mask['sales'].sum()) + " sales"),
+        ("Store type of the selected store", "Type",
+         ", ".join(sorted(str(store_type) for store_type in mask["store_type"].unique())) + " type"),
+    ]
+    return cards, (mask_sales_year, top_n(mask_products, "family", "sales"))
+
+
+@functools.lru_cache(maxsize=CALLBACK_CACHE_SIZE)
+def sheet_2_results(version, stores, years=(), period_range=None):
+    ensure_report()
+    with traced("filter"):
+        mask = filter_rows({"store_nbr": stores, "year": years}, period_range)
+    if mask.empty:
+        return None
+    cards, (mask_sales_year, mask_products) = sheet_2_tables(mask)
+    with traced("figures"):
+        traces = [figure_traces("barchart-store-sales", mask_sales_year),
+                  figure_traces("piechart-store-products", mask_products)]
+    return cards, traces
+
+
+@sheet_callback(
+    [Output("store-cards", "children"),
+     Output("store-traces", "data")],
+    Input("store-filter", "value"),
+    Input("store-year-filter", "value"),
+    Input("date-range", "value"),
+    **background_options("store-status")
+)
+@instrumented
+def update_charts_sheet_2(stores, years=None, months=None):
+    results = shared_results(sheet_2_results, data_version, selection(stores), selection(years),
+                             selected_periods(months))
+    if results is None:
+        return no_data_outputs("store")
+    cards, traces = results
+    return make_cards(cards), traces
+
+
+# Stores of the selected states: the options of the store dropdown, and the selected stores still among them
+# (or the first of them if none is)
 @app.callback(
+    [Output("store-filter", "options"),
+     Output("store-filter", "value")],
+    Input("store-state-filter", "value"),
+    State("store-filter", "value")
+)
+@instrumented
+def update_store_options(states, stores):
+    ensure_report()
+    options = filter_values("store_nbr", {"state": selection(states)})
+    available = [store for store in selection(stores) if store in options]
+    if not available and len(options):
+        available = [options[0]]
+    value = no_update if available == list(selection(stores)) else available
+    return [{"label": store_nbr, "value": store_nbr} for store_nbr in options], value
+
+
+# Sheet 3 I/O
+def sheet_3_tables(mask):
+    with traced("groupby"):
+        mask_categories = mask.groupby(by="family", as_index=False, observed=True)["sales"].sum()
+        mask_categories.sort_values(by="sales", ascending=False, inplace=True)
+
+        mask_stores = mask.groupby(by="store_nbr", as_index=False)["sales"].sum()
+        mask_stores["store_nbr"] = mask_stores["store_nbr"].apply(str)
+        mask_stores.sort_values(by="sales", ascending=True, inplace=True)
+
+        # Most common store type, counted over the rows of the region as Series.mode would do
+        mask_types = mask.groupby(by="store_type", observed=True)["rows"].sum()
+        mask_types = mask_types[mask_types == mask_types.max()].sort_index()
+
+    cards = [
+        ("Most profitable product category in the region", "Best product category",
+         str(mask_categories.iloc[0]["family"])),
+        ("Total number of sales made", "Sales", str(mask['sales'].sum()) + " sales"),
+        ("Most common type of store in the selected region", "Store type (most common)",
+         [str(store_type) + " type" for store_type in mask_types.index]),
+    ]
+    return cards, (mask_stores[-5:],)
+
+
+@functools.lru_cache(maxsize=CALLBACK_CACHE_SIZE)
+def sheet_3_results(version, states, families=(), years=(), period_range=None):
+    ensure_report()
+    with traced("filter"):
+        mask = filter_rows({"state": states, "family": families, "year": years}, period_range)
+    if mask.empty:
+        return None
+    cards, (mask_stores,) = sheet_3_tables(mask)
+    with traced("figures"):
+        traces = [figure_traces("barchart-state-sales", mask_stores)]
+    return cards, traces
+
+
+@sheet_callback(
+    [Output("state-cards", "children"),
+     Output("state-traces", "data")],
+    Input("state-filter", "value"),
+    Input("state-family-filter", "value"),
+    Input("state-year-filter", "value"),
+    Input("date-range", "value"),
+    **background_options("state-status")
+)
+@instrumented
+def update_charts_sheet_3(states, families=None, years=None, months=None):
+    results = shared_results(sheet_3_results, data_version, selection(states), selection(families), selection(years),
+                             selected_periods(months))
+    if results is None:
+        return no_data_outputs("state")
+    cards, traces = results
+    return make_cards(cards), traces
+
+
+# Sheet 4 I/O
+# Number of cities in the bar chart of a product category
+TOP_CITIES = 10
+
+
+# Place of every product category by sales, counted within every combination of the given keys (e.g. ["year"] or
+# ["state"]) or over all the sales
+def family_places(sales, by=()):
+    totals = sales.groupby(level=list(by) + ["family"]).sum()
+    places = totals.groupby(level=list(by)) if by else totals
+    return places.rank(method="first", ascending=False).astype(np.int64)
+
+
+# Ranking of the product categories over some rows of the cube, derived from one groupby of their sales by
+# category, state and city: place and total sales of every category, its best state and its top cities
+def rank_families(cube):
+    sales = cube.groupby(by=["family", "state", "city"], observed=True)["sales"].sum()
+    state_sales = sales.groupby(level=["family", "state"]).sum()
+    city_sales = sales.groupby(level=["family", "city"]).sum().sort_values(ascending=False)
+    top_cities = city_sales.groupby(level="family").head(TOP_CITIES).iloc[::-1]
+    return {"places": family_places(sales),
+            "sales": sales.groupby(level="family").sum(),
+            "top_states": state_sales.groupby(level="family").idxmax().map(lambda key: key[1]),
+            "cities": {family: cities.droplevel("family").rename("sales").reset_index()
+                       for family, cities in top_cities.groupby(level="family")}}
+
+
+# Ranking over a range of months
+@functools.lru_cache(maxsize=CALLBACK_CACHE_SIZE)
+def range_family_rankings(version, period_range):
+    return rank_families(filter_rows({}, period_range))
+
+
+def ordinal(place):
+    return "%d%s" % (place, "tsnrhtdd"[(place//10 % 10 != 1)*(place % 10 < 4)*place % 10::4])
+
+
+# Best state, total sales and top cities of some rows of the cube
+def sheet_4_totals(mask):
+    with traced("groupby"):
+        mask_cities = mask.groupby(by="city", as_index=False, observed=True)["sales"].sum()
+        mask_cities.sort_values(by="sales", ascending=True, inplace=True)
+        mask_cities = mask_cities[-TOP_CITIES:]
+
+        mask_states = mask.groupby(by="state", as_index=False, observed=True)["sales"].sum()
+        top_state = mask_states.loc[mask_states["sales"].idxmax(), "state"]
+        return top_state, mask['sales'].sum(), mask_cities
+
+
+@functools.lru_cache(maxsize=CALLBACK_CACHE_SIZE)
+def sheet_4_results(version, families, states=(), years=(), period_range=None):
+    ensure_report()
+    rankings = family_rankings if period_range is None else range_family_rankings(version, period_range)
+    # A product category without sales in the range of months has no place, and no product category selected means
+    # all of them
+    place = ", ".join(ordinal(rankings["places"][family]) for family in families if family in rankings["places"])
+    place = place + " place" if families else "All categories"
+
+    if not states and not years and len(families) == 1:
+        # A single product category is looked up in the ranking
+        if families[0] not in rankings["places"]:
+            return None
+        top_state = rankings["top_states"][families[0]]
+        total_sales = rankings["sales"][families[0]]
+        mask_cities = rankings["cities"][families[0]]
+    else:
+        with traced("filter"):
+            mask = filter_rows({"family": families, "state": states, "year": years}, period_range)
+        if mask.empty:
+            return None
+        top_state, total_sales, mask_cities = sheet_4_totals(mask)
+
+    cards = [
+        ("State in which the product was the most sold", "State (most successful)", str(top_state)),
+        ("Total number of sales made", "Sales", str(total_sales) + " sales"),
+        ("Place on the ranking of most profitable product", "Ranking categories", place),
+    ]
+
+    with traced("figures"):
+        traces = [figure_traces("barchart-product-city", mask_cities)]
+    return cards, traces
+
+
+@sheet_callback(
     [Output("product-cards", "children"),
-     Output("barchart-product-city", "figure")],
-    Input("product-filter", "value")
+     Output("product-traces", "data")],
+    Input("product-filter", "value"),
+    Input("product-state-filter", "value"),
+    Input("product-year-filter", "value"),
+    Input("date-range", "value"),
+    **background_options("product-status")
 )
-def update_charts_sheet_4(family):
-    place_int = int(dataframe_products[dataframe_products["family"] == family].index[0]) + 1
-    # Convert to ordinal
-    place = "%d%s" % (place_int, "tsnrhtdd"[(place_int//10 % 10 != 1)*(place_int % 10 < 4)*place_int % 10::4])
+@instrumented
+def update_charts_sheet_4(families, states=None, years=None, months=None):
+    results = shared_results(sheet_4_results, data_version, selection(families), selection(states), selection(years),
+                             selected_periods(months))
+    if results is None:
+        return no_data_outputs("product")
+    cards, traces = results
+    return make_cards(cards), traces
 
-    mask = dataframe[dataframe["family"] == family]
 
-    mask_cities = mask.groupby(by="city", as_index=False)["sales"].sum()
-    mask_cities.sort_values(by="sales", ascending=True, inplace=True)
+# Sheet 5 I/O
+# Sales uplift of the selected stores and product categories: their average daily sales on the days of a holiday
+# compared with those on the days without one, in percent. The tables are empty when there is nothing to compare
+def holiday_tables(stores, families=(), period_range=None):
+    index = indexed_holidays
+    sales, days = index["sales"] if families else index["store_sales"], index["days"]
+    with traced("filter"):
+        sales_rows = holiday_rows(sales, stores, families, period_range)
+        days_rows = holiday_rows(days, stores, (), period_range)
 
-    mask_states = mask.groupby(by="state", as_index=False)["sales"].sum()
-    mask_states.sort_values(by="sales", ascending=True, inplace=True)
+    with traced("groupby"):
+        size, on_holiday = len(index["holidays"]), index["on_holiday"]
+        holiday_sales = np.bincount(sales["holiday"][sales_rows], weights=sales["sales"][sales_rows], minlength=size)
+        holiday_days = np.bincount(days["holiday"][days_rows], weights=days["days"][days_rows], minlength=size)
+        normal_days = holiday_days[~on_holiday].sum()
+        baseline = holiday_sales[~on_holiday].sum() / normal_days if normal_days else 0
 
-    cards = dbc.Row(
-        children=[
-            dbc.Col(
-                dbc.Card(
-                    children=[
-                        dbc.CardHeader("State in which the product was the most sold"),
-                        dbc.CardBody(
-                            [
-                                html.H5("State (most successful)", className="card-title"),
-                                html.P(
-                                    str(mask_states.iloc[-1]["state"]),
-                                ),
-                            ]
-                        )
-                    ],
-                    color=random.choice(["warning", "secondary", "primary", "success", "danger"]),
-                    outline=True
-                )
-            ),
-            dbc.Col(
-                dbc.Card(
-                    children=[
-                        dbc.CardHeader("Total number of sales made"),
-                        dbc.CardBody(
-                            [
-                                html.H5("Sales", className="card-title"),
-                                html.P(
-                                    str(mask['sales'].sum()) + " sales",
+        def uplift(group):
+            codes, labels = index["groups"][group]
+            grouped = codes >= 0
+            groups = len(next(iter(labels.values())))
+            group_sales = np.bincount(codes[grouped], weights=holiday_sales[grouped], minlength=groups)
+            group_days = np.bincount(codes[grouped], weights=holiday_days[grouped], minlength=groups)
+            compared = (group_days > 0) & (baseline > 0)
+            table = {key: values[compared] for key, values in labels.items()}
+            table.update(sales=group_sales[compared], days=group_days[compared])
+            return pd.DataFrame(dict(table, uplift=(table["sales"] / table["days"] / baseline - 1) * 100))
 
-                                ),
-                            ]
-                        )
-                    ],
-                    color=random.choice(["warning", "secondary", "primary", "success", "danger"]),
-                    outline=True
-                )
-            ),
-            dbc.Col(
-                dbc.Card(
-                    children=[
-                        dbc.CardHeader("Place on the ranking of most profitable product"),
-                        dbc.CardBody(
-                            [
-                                html.H5("Ranking categories", className="card-title"),
-                                html.P(
-                                    place + ' place'
-                                ),
-                            ]
-                        )
-                    ],
-                    color=random.choice(["warning", "secondary", "primary", "success", "danger"]),
-                    outline=True
-                )
-            ),
+        # Every store is compared with its own days without a holiday
+        size = len(index["stores"])
+        store_sales = np.bincount(sales["store"][sales_rows] * 2 + on_holiday[sales["holiday"][sales_rows]],
+                                  weights=sales["sales"][sales_rows], minlength=2 * size).reshape(size, 2)
+        store_days = np.bincount(days["store"][days_rows] * 2 + on_holiday[days["holiday"][days_rows]],
+                                 weights=days["days"][days_rows], minlength=2 * size).reshape(size, 2)
+        compared = (store_days > 0).all(axis=1) & (store_sales[:, 0] > 0)
+        means = store_sales[compared] / store_days[compared]
+        by_store = pd.DataFrame({"store_nbr": index["stores"][compared].astype(str),
+                                 "uplift": (means[:, 1] / means[:, 0] - 1) * 100})
+        by_store.sort_values(by="uplift", ascending=False, inplace=True)
+        by_type, by_locale, overall = uplift("type"), uplift("locale"), uplift("overall")
+
+    cards = None
+    if len(overall):
+        holiday_days = overall["days"].sum()
+        cards = [
+            ("Days with a holiday in the selected stores", "Holiday days", "%d store-days" % holiday_days),
+            ("Average daily sales on holidays compared with the other days", "Holiday uplift",
+             "%+.1f %%" % ((overall["sales"].sum() / holiday_days / baseline - 1) * 100)),
+            ("Holiday type with the largest sales uplift", "Best holiday type",
+             str(overall.loc[overall["uplift"].idxmax(), "holiday_type"])),
         ]
+    return cards, (by_type, by_locale, by_store)
+
+
+@functools.lru_cache(maxsize=CALLBACK_CACHE_SIZE)
+def holiday_results(version, stores, families=(), period_range=None):
+    ensure_report()
+    cards, tables = holiday_tables(stores, families, period_range)
+    if cards is None:
+        return None
+    with traced("figures"):
+        traces = [figure_traces(graph_id, table) for graph_id, table in zip(sheet_graphs("holiday"), tables)]
+    return cards, traces
+
+
+@app.callback(
+    [Output("holiday-cards", "children"),
+     Output("holiday-traces", "data")],
+    Input("holiday-store-filter", "value"),
+    Input("holiday-family-filter", "value"),
+    Input("date-range", "value"),
+    **background_options("holiday-status")
+)
+@instrumented
+def update_charts_sheet_5(stores, families=None, months=None):
+    results = shared_results(holiday_results, data_version, selection(stores), selection(families),
+                             selected_periods(months))
+    if results is None:
+        return no_data_outputs("holiday")
+    cards, traces = results
+    return make_cards(cards), traces
+
+
+# Client-side I/O
+# Totals the browser draws sheets 2 to 4 from, over all the months: per store its yearly sales with and without
+# promotions, its type and its sales per sold product category; per state its sales per product category and per
+# store and its rows per store type; per product category its sales per city and per state and its place. The
+# figures of all the data are sent as templates, whose traces the browser fills in
+@functools.lru_cache(maxsize=1)
+def clientside_payload(version):
+    ensure_report()
+    cube = indexed_cube[0]
+    years = [int(year) for year in dimensions["year"]]
+    payload = {"years": years, "pie_top_n": PIE_TOP_N, "top_cities": TOP_CITIES, "no_data_cards": NO_DATA_CARDS,
+               "stores": {}, "states": {}, "families": {}}
+
+    # Years without sales of a store, with or without promotions, have no bar
+    store_years = cube.groupby(by=["store_nbr", "promoted", "year"])["sales"].sum().unstack("year")
+    store_years = store_years.reindex(columns=years)
+    for (store, promoted), sales in store_years.iterrows():
+        entry = payload["stores"].setdefault(str(store), {"sales": {}, "families": {}})
+        entry["sales"][str(bool(promoted))] = [None if np.isnan(value) else float(value) for value in sales]
+    sold = cube[cube["sold_rows"] != 0]
+    for (store, family), sales in sold.groupby(by=["store_nbr", "family"], observed=True)["sales"].sum().items():
+        payload["stores"][str(store)]["families"][str(family)] = float(sales)
+
+    for key, by, values in [("stores", "store_nbr", []), ("states", "state", ["family", "store_nbr", "store_type"]),
+                            ("families", "family", ["city", "state"])]:
+        groups = cube.groupby(by=by, observed=True)
+        for group, total in groups["sales"].sum().items():
+            payload[key].setdefault(str(group), {})["total"] = float(total)
+        for value in values:
+            measure = "rows" if value == "store_type" else "sales"
+            totals = cube.groupby(by=[by, value], observed=True)[measure].sum()
+            for (group, label), total in totals.items():
+                payload[key][str(group)].setdefault(value, {})[str(label)] = float(total)
+    for store, store_type in cube.groupby(by="store_nbr")["store_type"].first().items():
+        payload["stores"][str(store)]["type"] = str(store_type)
+    for family, place in family_rankings["places"].items():
+        payload["families"][str(family)]["place"] = int(place)
+
+    payload["templates"] = {prefix: list(figure_templates(version, prefix).values())
+                            for prefix in ["store", "state", "product"]}
+    return payload
+
+
+# Answer of the server to a selection the browser asked for, tagged with the key of the request: the cards and
+# the figures
+def answer_request(prefix, callback, request):
+    if not request:
+        return no_update
+    cards, traces = callback(*request["args"])
+    figures = [patched_figure(graph_id, graph_traces) for graph_id, graph_traces in zip(sheet_graphs(prefix), traces)]
+    return {"key": request["key"], "outputs": [cards] + figures}
+
+
+if CLIENTSIDE_CALLBACKS:
+    @app.callback(
+        Output('clientside-data', 'data'),
+        Input('data-version', 'data')
+    )
+    @instrumented
+    def load_clientside_data(version):
+        return clientside_payload(data_version)
+
+    # Every sheet is drawn by one function of assets/clientside.js from its dropdowns, or from the answer of the
+    # server to the selections it can not draw, which it asks for in "<prefix>-request"
+    for prefix, callback, inputs in [
+        ("store", update_charts_sheet_2, ["store-filter", "store-year-filter"]),
+        ("state", update_charts_sheet_3, ["state-filter", "state-family-filter", "state-year-filter"]),
+        ("product", update_charts_sheet_4, ["product-filter", "product-state-filter", "product-year-filter"]),
+    ]:
+        app.clientside_callback(
+            ClientsideFunction(namespace="godelicious", function_name=prefix),
+            [Output(prefix + "-cards", "children")] +
+            [Output(graph_id, "figure") for graph_id in sheet_graphs(prefix)] +
+            [Output(prefix + "-request", "data")],
+            [Input(input_id, "value") for input_id in inputs] +
+            [Input("date-range", "value"), Input(prefix + "-results", "data")],
+            [State("clientside-data", "data"), State("date-range", "min"), State("date-range", "max")]
+        )
+        app.callback(
+            Output(prefix + "-results", "data"),
+            Input(prefix + "-request", "data"),
+            prevent_initial_call=True
+        )(functools.partial(answer_request, prefix, callback))
+
+# The data of the traces sent by the server is put into the figures shown
+for prefix in ["holiday"] if CLIENTSIDE_CALLBACKS else ["store", "state", "product", "holiday"]:
+    app.clientside_callback(
+        ClientsideFunction(namespace="godelicious", function_name="patchFigures"),
+        [Output(graph_id, "figure") for graph_id in sheet_graphs(prefix)],
+        Input(prefix + "-traces", "data"),
+        [State(graph_id, "figure") for graph_id in sheet_graphs(prefix)],
+        prevent_initial_call=True
     )
 
-    figure_1 = px.bar(mask_cities[-10:],
-                      x="sales",
-                      y="city",
-                      template='ggplot2',
-                      orientation='h',
-                      height=600,
-                      width=1024)
-    figure_1.update_traces(marker_color='#73af48')
-    return cards, figure_1
+
+# Callback caches: statistics, warm up of every dropdown value and invalidation when the data is reloaded
+def callback_cache_info():
+    return {"sheet-1": sheet_1_results.cache_info(),
+            "sheet-2": sheet_2_results.cache_info(),
+            "sheet-3": sheet_3_results.cache_info(),
+            "sheet-4": sheet_4_results.cache_info(),
+            "sheet-5": holiday_results.cache_info()}
+
+
+def warm_callback_caches():
+    for store in dimensions["store_nbr"]:
+        sheet_2_results(data_version, (int(store),), (), None)
+    for state in dimensions["state"]:
+        sheet_3_results(data_version, (str(state),), (), (), None)
+    for family in dimensions["family"]:
+        sheet_4_results(data_version, (str(family),), (), (), None)
+
+
+def clear_callback_caches():
+    figure_templates.cache_clear()
+    sheet_1_results.cache_clear()
+    range_family_rankings.cache_clear()
+    sheet_2_results.cache_clear()
+    sheet_3_results.cache_clear()
+    sheet_4_results.cache_clear()
+    holiday_results.cache_clear()
+
+
+# Sheet 1, the ranking of product categories and the tabs, rebuilt whenever the aggregates change
+def refresh_report(pool=PRELOAD_POOL):
+    global sheet_1, sheet_1_figures, family_rankings, indexed_cube, indexed_holidays, dimensions, date_range, \
+        data_version, report_refreshed_at
+    with timed_stage("sheet 1 tables"):
+        sheet_1 = sheet_1_tables(partial_sums)
+        family_rankings = rank_families(dataframe_cube)
+        indexed_cube = (dataframe_cube, dimension_index(dataframe_cube), cumulative_months(dataframe_cube))
+        indexed_holidays = holiday_index(*holiday_sums)
+        month_years = partial_sums["month_year_sales"].index
+        periods = period_of(np.asarray(month_years.get_level_values("year"), dtype=np.int64),
+                            np.asarray(month_years.get_level_values("month"), dtype=np.int64))
+        date_range = (int(periods.min()), int(periods.max()))
+        dimensions = {key: np.sort(list(positions)) for key, positions in indexed_cube[1].items()}
+        # The version changes once the data it stands for is in place, and the cached results are keyed by it, so
+        # results computed from older data are never served for it. Counting the merged files keeps the version
+        # the same in every worker process
+        data_version = len(applied_deltas)
+    with timed_stage("sheet 1 figures"):
+        sheet_1_figures = build_sheet_1_figures(pool)
+    tabs.clear()
+    clear_callback_caches()
+    report_refreshed_at = time.time()
+
+
+# Positions in the cube of the rows of every value of the filtered dimensions, built once per cube so that a
+# selection takes its own rows instead of comparing every row of the cube. The keys are the dropdown values
+INDEX_KEYS = ["store_nbr", "state", "family", "year"]
+
+
+def dimension_index(cube):
+    return {key: cube.groupby(by=key, observed=True).indices for key in INDEX_KEYS}
+
+
+# Rows of the cube matching every filter, given as {dimension: selected values} where no values means no filter.
+# The positions of the selected values of a dimension are set in one bitmap of the cube, and the bitmaps of the
+# dimensions are intersected, so that a combined selection costs a few vectorized operations over the cube.
+# The rows keep the order of the cube, and the cube and its index are swapped together when the aggregates
+# change, so they always match
+def filter_rows(filters, period_range=None):
+    cube, index, cumulative = indexed_cube
+    selected = None
+    for key, values in filters.items():
+        if not values:
+            continue
+        bitmap = np.zeros(len(cube), dtype=bool)
+        for value in values:
+            positions = index[key].get(value)
+            if positions is not None:
+                bitmap[positions] = True
+        selected = bitmap if selected is None else selected & bitmap
+    if period_range is None:
+        return cube if selected is None else cube.take(np.flatnonzero(selected))
+    positions = np.arange(len(cube)) if selected is None else np.flatnonzero(selected)
+    return range_rows(cube, cumulative, positions, period_range)
+
+
+# Holiday aggregates as arrays of codes, so that a selection of stores, product categories and months costs a few
+# bitmaps and bincounts: the sales per store, product category, month and holiday, the same summed over the
+# product categories, and the number of days per store, month and holiday. The holidays are the rows of a table
+# of their attributes, and the stores and product categories are looked up in sorted arrays
+HOLIDAY_GROUPS = {"type": ["holiday_type", "transferred"], "locale": ["locale", "transferred"],
+                  "overall": ["holiday_type"]}
+
+
+def holiday_index(sales, calendar):
+    holidays = pd.concat([sales[HOLIDAY_KEYS], calendar[HOLIDAY_KEYS]], ignore_index=True).drop_duplicates()
+    holidays = holidays.sort_values(by=HOLIDAY_KEYS, ignore_index=True)
+    holiday_codes = pd.MultiIndex.from_frame(holidays)
+    index = {"holidays": holidays,
+             "stores": np.sort(calendar["store_nbr"].unique()),
+             "families": np.sort(sales["family"].astype(str).unique())}
+
+    def arrays(table, measure):
+        codes = {"store": np.searchsorted(index["stores"], table["store_nbr"].to_numpy()),
+                 "period": period_of(table["year"].to_numpy(dtype=np.int64), table["month"].to_numpy(dtype=np.int64)),
+                 "holiday": holiday_codes.get_indexer(pd.MultiIndex.from_frame(table[HOLIDAY_KEYS])),
+                 measure: table[measure].to_numpy(dtype=np.float64)}
+        if "family" in table:
+            codes["family"] = np.searchsorted(index["families"], table["family"].astype(str).to_numpy())
+        return codes
+
+    # Holidays of every group the uplift is shown for, -1 for the days without a holiday
+    on_holiday = (holidays["holiday_type"] != "").to_numpy()
+    index.update(on_holiday=on_holiday, groups={})
+    for group, by in HOLIDAY_GROUPS.items():
+        codes = np.full(len(holidays), -1)
+        codes[on_holiday] = holidays[on_holiday].groupby(by=by).ngroup().to_numpy()
+        labels = holidays[on_holiday].groupby(by=by).size().index.to_frame(index=False)
+        index["groups"][group] = (codes, {key: labels[key].to_numpy() for key in by})
+
+    store_sales = sales.groupby(by=["store_nbr", "year", "month"] + HOLIDAY_KEYS, as_index=False)["sales"].sum()
+    days = calendar.groupby(by=["store_nbr", "year", "month"] + HOLIDAY_KEYS).size().rename("days").reset_index()
+    index.update(sales=arrays(sales, "sales"), store_sales=arrays(store_sales, "sales"), days=arrays(days, "days"))
+    return index
+
+
+# Rows of holiday arrays of the selected stores and product categories (none meaning all) within a range of months
+def holiday_rows(arrays, stores, families=(), period_range=None):
+    selected = np.ones(len(arrays["holiday"]), dtype=bool)
+    for key, levels, values in [("store", "stores", stores), ("family", "families", families)]:
+        if values:
+            selected &= np.isin(indexed_holidays[levels], list(values))[arrays[key]]
+    if period_range is not None:
+        selected &= (arrays["period"] >= period_range[0]) & (arrays["period"] <= period_range[1])
+    return selected
+
+
+# Running totals of every measure of the cube over the months of each row, with a leading column of zeros
+def cumulative_months(cube):
+    cumulative = {}
+    for measure in CUBE_MEASURES:
+        by_month = cube[month_columns(measure)].to_numpy()
+        cumulative[measure] = np.concatenate([np.zeros((len(cube), 1), dtype=by_month.dtype),
+                                              np.cumsum(by_month, axis=1)], axis=1)
+    return cumulative
+
+
+# Rows of the cube at the given positions with their measures over a range of months only. The months of the
+# range within the year of a row are a slice of its months, so every total is the difference of two running
+# totals whatever the length of the range. Rows without data in the range are left out
+def range_rows(cube, cumulative, positions, period_range):
+    first_periods = period_of(cube["year"].to_numpy(dtype=np.int64)[positions], 1)
+    low = np.clip(period_range[0] - first_periods, 0, 12)
+    high = np.clip(period_range[1] - first_periods + 1, 0, 12)
+    rows = cube.take(positions)
+    for measure in CUBE_MEASURES:
+        rows[measure] = cumulative[measure][positions, high] - cumulative[measure][positions, low]
+    return rows[rows["rows"].to_numpy() != 0]
+
+
+# Sorted values of a dimension left by the other filters, for the options of a cross-filtered dropdown
+def filter_values(key, filters):
+    return np.sort(filter_rows(filters)[key].unique())
+
+
+# Selected range of months of the slider, or None when it covers all the data
+def selected_periods(value):
+    if not value:
+        return None
+    start, end = int(value[0]), int(value[1])
+    if start <= date_range[0] and end >= date_range[1]:
+        return None
+    return max(start, date_range[0]), min(end, date_range[1])
+
+
+# Dropdown values as a key of the callback caches, in the same order whatever the order they were picked in
+def selection(values):
+    if values is None:
+        return ()
+    if not isinstance(values, list):
+        values = [values]
+    return tuple(sorted(values))
+
+
+# Tabs are built the first time they are shown, and kept until the aggregates change
+TAB_BUILDERS = {'sheet-1': make_tab_1, 'sheet-2': make_tab_2, 'sheet-3': make_tab_3, 'sheet-4': make_tab_4,
+                'sheet-5': make_tab_5}
+tabs = {}
+
+
+def get_tab(tab):
+    if tab != 'sheet-1':
+        ensure_report()
+    if tab not in tabs:
+        tabs[tab] = TAB_BUILDERS[tab]()
+    return tabs[tab]
+
+
+# One stage of the pipeline
+def build_sheet_1_figure(graph_id):
+    with timed_stage("figure " + graph_id):
+        build_figure = {figure_id: build for figure_id, _, build in SHEET_1_FIGURES}[graph_id]
+        return figure_json(build_figure(sheet_1))
+
+
+# Figure of a forked stage, sent back as JSON text so that nothing has to import this module to unpickle it
+def send_sheet_1_figure(graph_id, results):
+    try:
+        results.put((graph_id, json.dumps(build_sheet_1_figure(graph_id))))
+    except Exception:
+        results.put((graph_id, None))
+        raise
+
+
+# Processes are forked, so that they inherit the tables instead of importing this module again.
+# A figure whose process failed, or exited without sending it (e.g. killed when out of memory), is built again here
+def build_sheet_1_figures(pool):
+    graph_ids = [graph_id for graph_id, _, _ in SHEET_1_FIGURES]
+    if pool == "process" and "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        results = context.SimpleQueue()
+        figures = {}
+        for start in range(0, len(graph_ids), PRELOAD_WORKERS):
+            batch = graph_ids[start:start + PRELOAD_WORKERS]
+            processes = [context.Process(target=send_sheet_1_figure, args=(graph_id, results)) for graph_id in batch]
+            for process in processes:
+                process.start()
+            pending = dict(zip(batch, processes))
+            while pending:
+                while not results.empty():
+                    graph_id, figure = results.get()
+                    figures[graph_id] = figure
+                    pending.pop(graph_id, None)
+                # A process puts its figure before it exits, so an exited one with nothing left to read sent none
+                for graph_id, process in list(pending.items()):
+                    if process.exitcode is not None and results.empty():
+                        logger.warning("figure %s: process exited with code %s", graph_id, process.exitcode)
+                        figures[graph_id] = None
+                        del pending[graph_id]
+                if pending:
+                    multiprocessing.connection.wait([process.sentinel for process in pending.values()], timeout=0.1)
+            for process in processes:
+                process.join()
+        return {graph_id: json.loads(figures[graph_id]) if figures[graph_id] is not None
+                else build_sheet_1_figure(graph_id) for graph_id in graph_ids}
+    if pool == "serial":
+        return {graph_id: build_sheet_1_figure(graph_id) for graph_id in graph_ids}
+    with concurrent.futures.ThreadPoolExecutor(PRELOAD_WORKERS) as executor:
+        return dict(zip(graph_ids, executor.map(build_sheet_1_figure, graph_ids)))
+
+
+# New daily sales files found in DELTA_DIR are merged into the aggregates, so the cost of an update
+# depends on the size of the new files only. A file that can not be read or merged is logged and left out,
+# without changing the aggregates, and the others are still merged. Returns whether any file was merged
+def merge_delta_files():
+    global partial_sums, dataframe_cube, holiday_sums
+    merged = False
+    for path in sorted(set(glob.glob(os.path.join(DELTA_DIR, "*.csv"))) - applied_deltas):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if failed_deltas.get(path) == (stat.st_size, stat.st_mtime_ns):
+            continue
+        try:
+            delta = pd.read_csv(path, dtype=dtypes, usecols=AGGREGATE_COLUMNS)
+            merged_sums, merged_cube, merged_holidays = partial_sums, dataframe_cube, holiday_sums
+            if len(delta):
+                delta["promoted"] = delta["onpromotion"] != 0
+                merged_sums = merge_partials(partial_sums, sheet_1_partials(delta))
+                merged_cube = merge_cubes(dataframe_cube, sales_cube(delta))
+                merged_holidays = merge_holiday_aggregates(holiday_sums, holiday_aggregates(delta))
+        except Exception as error:
+            logger.error("delta file %s not merged: %r", path, error)
+            failed_deltas[path] = (stat.st_size, stat.st_mtime_ns)
+            continue
+        partial_sums, dataframe_cube, holiday_sums = merged_sums, merged_cube, merged_holidays
+        applied_deltas.add(path)
+        failed_deltas.pop(path, None)
+        merged = True
+    return merged
+
+
+def csv_paths():
+    return [os.path.join(DATA_DIR, file_name) for file_name in CSV_FILES]
+
+
+# Everything the snapshot of sheet 1 depends on besides the csv files
+def snapshot_settings():
+    return {"version": SNAPSHOT_VERSION, "pie_top_n": PIE_TOP_N, "max_line_points": MAX_LINE_POINTS}
+
+
+def read_sheet_1_snapshot():
+    try:
+        with open(SNAPSHOT_FILE) as file:
+            snapshot = json.load(file)
+        if snapshot.get("settings") != snapshot_settings():
+            return None
+        fresh, touched = sources_are_fresh(snapshot["sources"], csv_paths())
+    except (OSError, ValueError, KeyError):
+        return None
+    if not fresh:
+        return None
+    if touched:
+        write_file_atomically(SNAPSHOT_FILE, json.dumps(snapshot))
+    return snapshot
+
+
+def write_sheet_1_snapshot():
+    snapshot = {"settings": snapshot_settings(),
+                "sources": [file_fingerprint(path) for path in csv_paths()],
+                "counts": {key: int(value) for key, value in sheet_1["counts"].items()},
+                "date_range": list(date_range),
+                "figures": sheet_1_figures}
+    try:
+        write_file_atomically(SNAPSHOT_FILE, json.dumps(snapshot))
+    except OSError as error:
+        logger.warning("sheet 1 snapshot not saved: %s", error)
+
+
+# Text written to a temporary file first, so that a half written file is never read
+def write_file_atomically(path, content):
+    temporary_path = "%s.tmp-%d" % (path, os.getpid())
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        file.write(content)
+    os.replace(temporary_path, path)
+
+
+# Loading the data, its aggregates and the delta files, and building sheet 1 and the indexes of the other sheets
+def load_report(pool=PRELOAD_POOL):
+    global data_loaded_at, partial_sums, dataframe_cube, holiday_sums, first_row, report_loaded
+    with timed_stage("load data"):
+        frame = None if STREAMING_CHUNK_SIZE else load_dataframe()
+    data_loaded_at = time.time()
+    with timed_stage("aggregates"):
+        partial_sums, dataframe_cube, holiday_sums, first_row = compute_aggregates(frame)
+    # Only the aggregates are kept; data_column reads any column asked for later from the columnar cache
+    del frame
+    if DELTA_DIR is not None:
+        with timed_stage("delta files"):
+            merge_delta_files()
+    refresh_report(pool)
+    report_loaded = True
+
+
+report_loaded = False
+report_lock = threading.Lock()
+
+
+# Everything but sheet 1 needs the data: when the server started from the snapshot it is loaded here once,
+# and every caller waits for it. The server is running threads by then, so nothing is built in forked processes
+def ensure_report():
+    if not report_loaded:
+        with report_lock:
+            if not report_loaded:
+                load_report(pool="thread")
+
+
+# Background callbacks run in processes forked from the server, which would copy the report lock held by a thread
+# loading the data and wait for it forever, or load the whole data again on their own. So with them the report
+# is loaded here, before the server starts, instead of from the snapshot
+with timed_stage("sheet 1 snapshot"):
+    snapshot = read_sheet_1_snapshot() if background_manager is None else None
+if snapshot is None:
+    with report_lock:
+        load_report()
+    if not applied_deltas:
+        write_sheet_1_snapshot()
+else:
+    sheet_1 = {"counts": snapshot["counts"]}
+    sheet_1_figures = snapshot["figures"]
+    date_range = tuple(snapshot["date_range"])
+    logger.info("sheet 1 loaded from %s", SNAPSHOT_FILE)
+
+
+# Sheets 2 to 4, and the callback caches if asked to, are prepared in the background, so that sheet 1
+# can be served as soon as the server is up
+def warm_up():
+    if not report_loaded:
+        if not PRELOAD_REPORT:
+            return
+        ensure_report()
+    with timed_stage("tabs of sheets 2-5"):
+        for tab in ['sheet-2', 'sheet-3', 'sheet-4', 'sheet-5']:
+            get_tab(tab)
+    if WARM_CALLBACK_CACHES:
+        with timed_stage("callback caches"):
+            warm_callback_caches()
+
+
+warm_up_thread = threading.Thread(target=warm_up, daemon=True)
+warm_up_thread.start()
+
+
+# Delta files I/O
+@app.callback(
+    Output('data-version', 'data'),
+    Input('delta-interval', 'n_intervals'),
+    State('data-version', 'data')
+)
+@instrumented
+def check_delta_files(n_intervals, version):
+    if DELTA_DIR is None:
+        return no_update
+    ensure_report()
+    # The server is running threads by now, so the figures are not built in forked processes
+    with delta_lock:
+        if merge_delta_files():
+            refresh_report(pool="thread")
+    return data_version if data_version != version else no_update
 
 
 # Tabs I/O
 @app.callback(
     Output('tabs-content-inline', 'children'),
-    Input('tabs-styled-with-inline', 'value')
+    Input('tabs-styled-with-inline', 'value'),
+    Input('data-version', 'data')
 )
-def render_content(tab):
-    if tab == 'sheet-1':
-        return tab_1
-    elif tab == 'sheet-2':
-        return tab_2
-    elif tab == 'sheet-3':
-        return tab_3
-    elif tab == 'sheet-4':
-        return tab_4
+@instrumented
+def render_content(tab, version):
+    if tab in TAB_BUILDERS:
+        return get_tab(tab)
+
+
+# Metrics I/O: latency of every request, which includes the serialization of the callback responses by Dash
+@server.before_request
+def start_request_timer():
+    flask.g.request_start = time.perf_counter()
+
+
+@server.after_request
+def observe_request(response):
+    if "request_start" in flask.g:
+        # Labelled by route rather than path, so that unknown urls do not add series
+        rule = flask.request.url_rule.rule if flask.request.url_rule is not None else "unmatched"
+        observe("godelicious_request_seconds", {"route": rule},
+                time.perf_counter() - flask.g.request_start)
+    return response
+
+
+# Current and peak resident memory of this process in bytes
+def memory_usage():
+    usage = {}
+    try:
+        with open("/proc/self/statm") as file:
+            usage["resident"] = int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # Kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        usage["peak_resident"] = peak * (1 if sys.platform == "darwin" else 1024)
+    return usage
+
+
+def format_labels(labels):
+    return "{%s}" % ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                             for name, value in labels)
+
+
+def metrics():
+    lines = []
+    with histograms_lock:
+        snapshot = {key: dict(histogram, buckets=list(histogram["buckets"])) for key, histogram in histograms.items()}
+    for metric in sorted({metric for metric, _ in snapshot}):
+        lines.append("# TYPE %s histogram" % metric)
+        for (name, labels), histogram in sorted(snapshot.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip(HISTOGRAM_BUCKETS, histogram["buckets"]):
+                cumulative += count
+                lines.append("%s_bucket%s %d" % (metric, format_labels(labels + (("le", repr(float(bound))),)),
+                                                 cumulative))
+            lines.append("%s_bucket%s %d" % (metric, format_labels(labels + (("le", "+Inf"),)), histogram["count"]))
+            lines.append("%s_sum%s %r" % (metric, format_labels(labels), histogram["sum"]))
+            lines.append("%s_count%s %d" % (metric, format_labels(labels), histogram["count"]))
+
+    gauges = [("godelicious_data_version", (), data_version)]
+    if report_loaded:
+        gauges += [("godelicious_data_loaded_timestamp_seconds", (), data_loaded_at),
+                   ("godelicious_report_refreshed_timestamp_seconds", (), report_refreshed_at),
+                   ("godelicious_cube_rows", (), len(dataframe_cube))]
+    gauges += [("godelicious_memory_%s_bytes" % kind, (), value) for kind, value in memory_usage().items()]
+    with in_flight_lock:
+        gauges += [("godelicious_coalesced_calls", (("function", name),), calls)
+                   for name, calls in sorted(coalesced_calls.items())]
+    for sheet, info in callback_cache_info().items():
+        gauges += [("godelicious_callback_cache_hits", (("sheet", sheet),), info.hits),
+                   ("godelicious_callback_cache_misses", (("sheet", sheet),), info.misses),
+                   ("godelicious_callback_cache_entries", (("sheet", sheet),), info.currsize)]
+    for metric in dict.fromkeys(name for name, _, _ in gauges):
+        lines.append("# TYPE %s gauge" % metric)
+        lines += ["%s%s %r" % (metric, format_labels(labels) if labels else "", value)
+                  for name, labels, value in gauges if name == metric]
+    return "\n".join(lines) + "\n", 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+if METRICS_ROUTE:
+    server.add_url_rule(METRICS_ROUTE, "metrics", metrics)
+
+stage_timings["startup"] = time.perf_counter() - startup_time
+observe("godelicious_stage_seconds", {"stage": "startup"}, stage_timings["startup"])
+logger.info("startup: %.3f s", stage_timings["startup"])
+
+
+# Static export: sheet 1 and every store, state and product category of sheets 2 to 4 over all the months, written
+# as HTML pages and JSON files that any static file server can serve. The pages take their cards and figure titles
+# from the tabs, and the variants are computed by the callbacks' own functions in forked processes
+#
+#   python main.py export static_report --workers 8
+EXPORT_SHEETS = {"sheet-2": ("store", "store_nbr", sheet_2_results), "sheet-3": ("state", "state", sheet_3_results),
+                 "sheet-4": ("product", "family", sheet_4_results),
+                 "sheet-5": ("holiday", "store_nbr", holiday_results)}
+
+EXPORT_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+%(stylesheets)s
+<script src="%(root)splotly.min.js"></script>
+</head>
+<body>
+<div class="header">
+<p class="header-emoji">📊</p>
+<h1 class="header-title">Godelicious Dashboard</h1>
+<p class="header-description">%(description)s</p>
+</div>
+%(content)s
+</body>
+</html>
+"""
+
+
+# Components of a layout, depth first
+def layout_components(component):
+    yield component
+    children = getattr(component, "children", None)
+    for child in children if isinstance(children, (list, tuple)) else [children]:
+        if hasattr(child, "to_plotly_json"):
+            yield from layout_components(child)
+
+
+# Cards written in a tab, as (header, title, text), and the graphs of its figures with their titles
+def layout_parts(component):
+    cards, graphs = [], []
+    for part in layout_components(component):
+        if isinstance(part, dbc.Card):
+            header, body = part.children
+            title, text = body.children
+            cards.append((header.children, title.children, text.children))
+        elif getattr(part, "className", None) == "figure":
+            title, graph = part.children
+            graphs.append((graph.id, title.children))
+    return cards, graphs
+
+
+# File name of a dropdown value, e.g. "BREAD/BAKERY" -> "bread-bakery"
+def export_name(value):
+    return re.sub(r"[^a-z0-9]+", "-", str(value).lower()).strip("-") or "value"
+
+
+# Stylesheets of the app and its style.css, copied next to the pages
+def export_stylesheets(root):
+    links = [stylesheet["href"] if isinstance(stylesheet, dict) else stylesheet for stylesheet in external_stylesheets]
+    return "".join('<link rel="stylesheet" href="%s">' % link for link in links + [root + "style.css"])
+
+
+def export_page(path, title, description, cards, graphs, figures):
+    cards_html = "".join(
+        '<div class="col"><div class="card border-%s"><div class="card-header">%s</div><div class="card-body">'
+        '<h5 class="card-title">%s</h5><p>%s</p></div></div></div>'
+        % (CARD_COLORS[index % len(CARD_COLORS)], escape(header), escape(card_title),
+           escape("".join(text) if isinstance(text, list) else str(text)))
+        for index, (header, card_title, text) in enumerate(cards))
+    figures_html = "".join(
+        '<div class="figure"><h4 class="figure-text">%s</h4><div id="%s"></div></div>' % (escape(graph_title), graph_id)
+        for graph_id, graph_title in graphs)
+    scripts = "".join(
+        '<script>(function (figure) { Plotly.newPlot("%s", figure.data, figure.layout); })(%s);</script>'
+        % (graph_id, json.dumps(figures[graph_id]).replace("</", "<\\/")) for graph_id, _ in graphs)
+    content = ('<p><a href="../index.html">All sheets</a></p><div class="card-box"><div class="row mb-4">%s</div>'
+               '</div><div class="figure-box">%s</div>%s' % (cards_html, figures_html, scripts))
+    write_file_atomically(path, EXPORT_PAGE % {
+        "title": escape(title), "stylesheets": export_stylesheets("../"), "root": "../",
+        "description": escape(description), "content": content})
+
+
+# One store, state or product category of a sheet: its page and its JSON, or None when it has no sales
+def export_variant(directory, tab, label, value, name, graphs):
+    prefix, _, results_of = EXPORT_SHEETS[tab]
+    results = results_of(data_version, (value,))
+    if results is None:
+        return None
+    cards, traces = results
+    figures = {graph_id: patched_figure(graph_id, graph_traces)
+               for graph_id, graph_traces in zip(sheet_graphs(prefix), traces)}
+    export_page(os.path.join(directory, tab, name + ".html"), "%s: %s" % (label, value), str(value),
+                cards, graphs, figures)
+    write_file_atomically(os.path.join(directory, tab, name + ".json"),
+                          json.dumps({"value": value, "cards": cards, "figures": figures}))
+    return tab, str(value), name
+
+
+def export_report(directory, workers=PRELOAD_WORKERS):
+    ensure_report()
+    # Nothing may hold a lock of this process when it is forked
+    warm_up_thread.join()
+    start = time.perf_counter()
+    labels = {tab.value: tab.label for tab in layout_components(serve_layout()) if isinstance(tab, dcc.Tab)}
+    for tab in TAB_BUILDERS:
+        os.makedirs(os.path.join(directory, tab), exist_ok=True)
+    write_file_atomically(os.path.join(directory, "plotly.min.js"), get_plotlyjs())
+    shutil.copyfile(os.path.join(app.config.assets_folder, "style.css"), os.path.join(directory, "style.css"))
+
+    cards, graphs = layout_parts(get_tab("sheet-1"))
+    export_page(os.path.join(directory, "sheet-1", "all.html"), labels["sheet-1"], "All the data", cards, graphs,
+                sheet_1_figures)
+    write_file_atomically(os.path.join(directory, "sheet-1", "all.json"),
+                          json.dumps({"cards": cards, "figures": sheet_1_figures}))
+
+    variants = []
+    for tab, (_, dimension, _) in EXPORT_SHEETS.items():
+        _, graphs = layout_parts(get_tab(tab))
+        names = set()
+        for value in dimensions[dimension]:
+            value = value.item() if hasattr(value, "item") else value
+            # Values differing only in punctuation get numbered names
+            name = base = export_name(value)
+            while name in names:
+                name = "%s-%d" % (base, len(names))
+            names.add(name)
+            variants.append((directory, tab, labels[tab], value, name, graphs))
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        executor = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"))
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+    with executor:
+        pages = [page for page in executor.map(export_variant, *zip(*variants)) if page is not None]
+
+    index = {"sheet-1": {"all": "sheet-1/all.json"}}
+    links = ['<h4>%s</h4><p><a href="sheet-1/all.html">All the data</a></p>' % escape(labels["sheet-1"])]
+    for tab in EXPORT_SHEETS:
+        tab_pages = [(value, name) for page_tab, value, name in pages if page_tab == tab]
+        index[tab] = {value: "%s/%s.json" % (tab, name) for value, name in tab_pages}
+        links.append("<h4>%s</h4><p>%s</p>" % (escape(labels[tab]), " | ".join(
+            '<a href="%s/%s.html">%s</a>' % (tab, name, escape(value)) for value, name in tab_pages)))
+    write_file_atomically(os.path.join(directory, "index.json"), json.dumps(index))
+    write_file_atomically(os.path.join(directory, "index.html"), EXPORT_PAGE % {
+        "title": escape(app.title), "stylesheets": export_stylesheets(""), "root": "",
+        "description": "Static export of the report", "content": '<div class="card-box">%s</div>' % "".join(links)})
+    logger.info("%d pages exported to %s in %.3f s", len(pages) + 1, directory, time.perf_counter() - start)
 
 
 if __name__ == "__main__":
-    app.run_server(debug=True)
+    parser = argparse.ArgumentParser(description="Godelicious dashboard.")
+    commands = parser.add_subparsers(dest="command")
+    export_parser = commands.add_parser("export", help="write every sheet and dropdown value as static HTML and JSON")
+    export_parser.add_argument("directory", nargs="?", default="static_report",
+                               help="directory where the pages are written (default: static_report)")
+    export_parser.add_argument("--workers", type=int, default=PRELOAD_WORKERS,
+                               help="number of processes computing the pages (default: one per core)")
+    arguments = parser.parse_args()
+    if arguments.command == "export":
+        export_report(arguments.directory, arguments.workers)
+    else:
+        app.run_server(debug=True)